@@ -0,0 +1,211 @@
+# app/cache.py
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+CACHE_ROOT = os.environ.get("CACHE_ROOT", "cache")
+EMBEDDING_CACHE_FILE = os.path.join(CACHE_ROOT, "embeddings.sqlite")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+RESPONSE_CACHE_FILE = os.path.join(CACHE_ROOT, "responses.sqlite")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "20000"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    # Persistent (model, sha256(text)) -> float32 vector store. When the row count passes
+    # max_entries, the least recently used tenth is evicted.
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding ("
+            " model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_embedding_last_used ON embedding (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embedding").fetchone()[0]
+
+    def get_many(self, model: str, hashes: List[str]) -> dict:
+        found = {}
+        if not hashes:
+            return found
+        now = time.time()
+        with self._lock:
+            unique = list(dict.fromkeys(hashes))
+            for i in range(0, len(unique), 500):
+                batch = unique[i:i + 500]
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embedding WHERE model = ? AND text_hash IN ({marks})",
+                    [model, *batch],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embedding SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in found],
+                )
+                self._conn.commit()
+            self.hits += sum(1 for h in hashes if h in found)
+            self.misses += sum(1 for h in hashes if h not in found)
+        return found
+
+    def put_many(self, model: str, items: dict):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, h, np.asarray(v, dtype=np.float32).tobytes(), now) for h, v in items.items()],
+            )
+            self._conn.commit()
+            self._count = self._conn.execute("SELECT COUNT(*) FROM embedding").fetchone()[0]
+            if self._count > self.max_entries:
+                keep = int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM embedding WHERE rowid IN (SELECT rowid FROM embedding ORDER BY last_used ASC LIMIT ?)",
+                    (self._count - keep,),
+                )
+                self._conn.commit()
+                self._count = keep
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": self._count,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    # Wraps an Embeddings model so document chunks are looked up in the EmbeddingCache
+    # before calling the remote API. Queries are passed straight through.
+
+    def __init__(self, underlying: Embeddings, model_name: str, cache: EmbeddingCache):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [_text_hash(t) for t in texts]
+        found = self.cache.get_many(self.model_name, hashes)
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in found:
+                missing.setdefault(h, t)
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_name, fresh)
+            found.update(fresh)
+        return [found[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+
+class ResponseCache:
+    # Persistent (model, sha256(prompt + generation config)) -> response text store for model
+    # calls whose output is a pure function of their input. Entries older than ttl_seconds
+    # are misses; past max_entries the least recently used tenth is evicted.
+
+    def __init__(self, path: str, max_entries: int, ttl_seconds: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response ("
+            " model TEXT NOT NULL, key TEXT NOT NULL, text TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_response_last_used ON response (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM response").fetchone()[0]
+
+    @staticmethod
+    def key_for(prompt: str, config: str = "") -> str:
+        return _text_hash(f"{config}\x00{prompt}")
+
+    def get(self, model: str, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, created FROM response WHERE model = ? AND key = ?", (model, key)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM response WHERE model = ? AND key = ?", (model, key))
+                self._conn.commit()
+                self._count -= 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE response SET last_used = ? WHERE model = ? AND key = ?", (now, model, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, model: str, key: str, text: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response (model, key, text, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (model, key, text, now, now),
+            )
+            self._conn.commit()
+            self._count = self._conn.execute("SELECT COUNT(*) FROM response").fetchone()[0]
+            if self._count > self.max_entries:
+                keep = int(self.max_entries * 0.9)
+                self._conn.execute("DELETE FROM response WHERE created < ?", (now - self.ttl_seconds,))
+                self._conn.execute(
+                    "DELETE FROM response WHERE rowid IN (SELECT rowid FROM response ORDER BY last_used ASC LIMIT"
+                    " max(0, (SELECT COUNT(*) FROM response) - ?))",
+                    (keep,),
+                )
+                self._conn.commit()
+                self._count = self._conn.execute("SELECT COUNT(*) FROM response").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": self._count,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+            }
+
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_FILE, EMBEDDING_CACHE_MAX_ENTRIES)
+response_cache = ResponseCache(RESPONSE_CACHE_FILE, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS)
@@ -0,0 +1,108 @@
+# app/conversation_summary.py
+# Rolling per-project summary of the chat history. After each saved turn a background task
+# folds the turns that have dropped out of the verbatim window into ConversationSummary, so
+# a question carries the summary plus only the last few turns instead of replaying the raw
+# history. Until the summary has caught up, the turns it does not cover yet are sent
+# verbatim, newest first as far as the history token budget reaches. A long backlog (e.g.
+# an old project's first question) is folded at most SUMMARY_MAX_BATCHES_PER_RUN batches
+# per saved turn, so catching up is spread over the following questions.
+import os
+import asyncio
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlmodel import Session, select, delete
+
+from app.database import engine
+from app.models import History, ConversationSummary
+from app.prompt_budget import estimate_tokens
+from app.services import generate_text
+from prompts import create_history_summary_prompt
+
+HISTORY_VERBATIM_TURNS = int(os.environ.get("HISTORY_VERBATIM_TURNS", "3"))
+SUMMARY_FOLD_BATCH = int(os.environ.get("SUMMARY_FOLD_BATCH", "20"))
+SUMMARY_MAX_BATCHES_PER_RUN = int(os.environ.get("SUMMARY_MAX_BATCHES_PER_RUN", "2"))
+HISTORY_FETCH_BATCH = 20
+
+# Running summary tasks, referenced here so they are not garbage-collected mid-run
+_tasks = set()
+_locks = {}
+
+
+def history_for_prompt(session: Session, project_id: int, max_tokens: Optional[int] = None) -> Tuple[str, List[str]]:
+    # (summary, verbatim turns oldest first). Turns are read newest first in small batches
+    # and reading stops once max_tokens is reached, so a lagging summary costs no more rows
+    # than the prompt can hold.
+    summary = session.exec(select(ConversationSummary).where(ConversationSummary.project_id == project_id)).first()
+    covered = summary.last_history_id if summary else 0
+    rows = session.exec(
+        select(History.question, History.answer).where(History.project_id == project_id, History.id > covered)
+        .order_by(History.created_at.desc(), History.id.desc())
+        .execution_options(yield_per=HISTORY_FETCH_BATCH)
+    )
+    turns = []; used = 0
+    for question, answer in rows:
+        turn = f"ש: {question}\nת: {answer}"
+        turns.append(turn)
+        used += estimate_tokens(turn)
+        if max_tokens is not None and used >= max_tokens:
+            break
+    rows.close()
+    return (summary.summary if summary else ""), turns[::-1]
+
+def clear_summary(session: Session, project_id: int):
+    session.exec(delete(ConversationSummary).where(ConversationSummary.project_id == project_id))
+
+def _pending_turns(project_id: int):
+    with Session(engine) as session:
+        summary = session.exec(select(ConversationSummary).where(ConversationSummary.project_id == project_id)).first()
+        covered = summary.last_history_id if summary else 0
+        recent = session.exec(
+            select(History.id).where(History.project_id == project_id)
+            .order_by(History.created_at.desc()).limit(HISTORY_VERBATIM_TURNS)
+        ).all()
+        if len(recent) < HISTORY_VERBATIM_TURNS:
+            return None
+        turns = session.exec(
+            select(History).where(History.project_id == project_id, History.id > covered, History.id < min(recent))
+            .order_by(History.id).limit(SUMMARY_FOLD_BATCH)
+        ).all()
+        if not turns:
+            return None
+        return (summary.summary if summary else ""), [(t.question, t.answer) for t in turns], turns[-1].id
+
+def _save_summary(project_id: int, text: str, last_history_id: int):
+    with Session(engine) as session:
+        if session.get(History, last_history_id) is None:
+            # The chat was cleared while the summary was being written
+            return False
+        summary = session.exec(select(ConversationSummary).where(ConversationSummary.project_id == project_id)).first()
+        if summary is None:
+            summary = ConversationSummary(project_id=project_id)
+        summary.summary = text
+        summary.last_history_id = last_history_id
+        summary.updated_at = datetime.utcnow()
+        session.add(summary)
+        session.commit()
+    return True
+
+async def _update_summary(project_id: int):
+    lock = _locks.setdefault(project_id, asyncio.Lock())
+    async with lock:
+        try:
+            for _ in range(SUMMARY_MAX_BATCHES_PER_RUN):
+                pending = await asyncio.to_thread(_pending_turns, project_id)
+                if pending is None:
+                    return
+                previous, turns, last_id = pending
+                text = await generate_text(create_history_summary_prompt(previous, turns))
+                if not await asyncio.to_thread(_save_summary, project_id, text.strip(), last_id):
+                    return
+        except Exception as e:
+            # The turns stay unsummarized and are folded in after the next question
+            print(f"Conversation summary for project {project_id} failed: {e}")
+
+def schedule_summary_update(project_id: int):
+    # Must be called from the event loop (i.e. an async route or stream)
+    task = asyncio.create_task(_update_summary(project_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
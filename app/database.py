@@ -1,8 +1,100 @@
 # app/database.py
+import os
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
 from sqlmodel import create_engine, SQLModel
 
 DB_FILE = "db.sqlite"
-engine = create_engine(f"sqlite:///{DB_FILE}", echo=False)
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL").upper()
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", "30"))
+
+# Connections are handed between the event loop, the threadpool and the ingestion workers,
+# so the same-thread check is off and the pool does the serialising
+engine = create_engine(
+    f"sqlite:///{DB_FILE}", echo=False,
+    connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+    poolclass=QueuePool, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+)
+
+@event.listens_for(engine, "connect")
+def _apply_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    finally:
+        cursor.close()
+
+SYNCHRONOUS_NAMES = {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"}
+
+def sqlite_profile() -> dict:
+    # The pragmas as SQLite reports them, which can differ from what was asked for
+    # (e.g. WAL is refused on some network filesystems)
+    with engine.connect() as conn:
+        def pragma(name):
+            return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+        effective = {
+            "journal_mode": str(pragma("journal_mode")).upper(),
+            "synchronous": SYNCHRONOUS_NAMES.get(pragma("synchronous"), str(pragma("synchronous"))),
+            "busy_timeout_ms": pragma("busy_timeout"),
+            "mmap_size": pragma("mmap_size"),
+        }
+    requested = {
+        "journal_mode": SQLITE_JOURNAL_MODE,
+        "synchronous": SQLITE_SYNCHRONOUS,
+        "busy_timeout_ms": SQLITE_BUSY_TIMEOUT_MS,
+        "mmap_size": SQLITE_MMAP_SIZE,
+    }
+    return {
+        "effective": effective,
+        "mismatched": sorted(k for k in requested if str(requested[k]) != str(effective[k])),
+        "pool": {"size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "timeout": DB_POOL_TIMEOUT},
+    }
+
+def check_sqlite_profile():
+    try:
+        profile = sqlite_profile()
+    except Exception as e:
+        print(f"Could not read SQLite settings: {e}")
+        return
+    print(f"SQLite settings: {profile['effective']}, pool {profile['pool']}")
+    if profile["mismatched"]:
+        print(f"SQLite did not apply the requested settings for: {', '.join(profile['mismatched'])}")
+
+def _ensure_schema():
+    # create_all only creates missing tables; columns added to existing models are applied here
+    try:
+        with engine.begin() as conn:
+            def add_column(table: str, column: str, type: str):
+                try:
+                    cols = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})").fetchall()}
+                    if column not in cols:
+                        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {type}")
+                except Exception as e:
+                    print(f"Could not add column {column} to table {table}: {e}")
+            add_column("libraryfile", "state", "VARCHAR NOT NULL DEFAULT 'done'")
+            add_column("tempfile", "state", "VARCHAR NOT NULL DEFAULT 'done'")
+            add_column("libraryfile", "content_hash", "VARCHAR")
+            add_column("tempfile", "content_hash", "VARCHAR")
+            # create_all skips indexes of tables that already exist, so every index declared
+            # on the models is created here if missing
+            for table in SQLModel.metadata.sorted_tables:
+                for index in table.indexes:
+                    try:
+                        index.create(conn, checkfirst=True)
+                    except Exception as e:
+                        print(f"Could not create index {index.name}: {e}")
+    except Exception as e:
+        print(f"Could not perform schema check: {e}")
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    _ensure_schema()
+    check_sqlite_profile()
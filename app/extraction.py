@@ -0,0 +1,150 @@
+# app/extraction.py
+# Page-level text extraction. PDFs are split into page ranges that are parsed in a process
+# pool, and pages are yielded in order as soon as their range is done, so callers can chunk
+# and embed the start of a book while the rest is still being parsed. The pool is shared by
+# the whole process and always uses spawn (callers are threads, where fork is unsafe, and
+# Windows has nothing else). Each task opens and closes the file itself, so no worker holds
+# a handle that would block deleting it on Windows. Kept free of the langchain imports so
+# workers start quickly.
+#
+# Extracted text is kept as a gzip JSON sidecar per content hash under cache/text, holding
+# the joined text plus the offset of each page (PDF) or paragraph (DOCX), so re-indexing
+# and previews never parse the original file again.
+import os
+import gzip
+import json
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional
+import docx
+import PyPDF2
+
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 2)))
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "25"))
+EXTRACTED_TEXT_ROOT = os.path.join(os.environ.get("CACHE_ROOT", "cache"), "text")
+PAGE_SEPARATOR = "\n"
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+def _extract_pdf_range(file_path: str, start: int, end: int) -> List[str]:
+    # Runs in a pool worker. PdfReader only reads the cross-reference table up front and
+    # parses pages as they are accessed, so opening the file per range stays cheap.
+    with open(file_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+def _iter_pdf_pages(file_path: str) -> Iterator[str]:
+    with open(file_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        page_count = len(reader.pages)
+        if page_count <= PDF_PAGES_PER_TASK or PDF_EXTRACT_WORKERS <= 1:
+            for i in range(page_count):
+                yield reader.pages[i].extract_text() or ""
+            return
+    pool = _get_pdf_pool()
+    futures = [
+        pool.submit(_extract_pdf_range, file_path, start, min(start + PDF_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PDF_PAGES_PER_TASK)
+    ]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+def iter_pages(file_path: str) -> Iterator[str]:
+    # PDF pages, DOCX paragraphs, or the whole of a .txt file; other types yield nothing
+    ext = (os.path.splitext(file_path)[1] or "").lower()
+    if ext == '.pdf':
+        yield from _iter_pdf_pages(file_path)
+    elif ext == '.docx':
+        for para in docx.Document(file_path).paragraphs:
+            yield para.text
+    elif ext == '.txt':
+        with open(file_path, 'r', encoding='utf-8') as f:
+            yield f.read()
+
+def _unit(file_path: str) -> str:
+    return "paragraph" if file_path.lower().endswith(".docx") else "page"
+
+def extract_text(file_path: str) -> str:
+    return PAGE_SEPARATOR.join(iter_pages(file_path))
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _sidecar_path(content_hash: str) -> str:
+    return os.path.join(EXTRACTED_TEXT_ROOT, content_hash[:2], f"{content_hash}.json.gz")
+
+def load_extracted(content_hash: Optional[str]) -> Optional[dict]:
+    # {"unit": "page" | "paragraph", "offsets": [start of each unit in text], "text": str}
+    if not content_hash:
+        return None
+    try:
+        with gzip.open(_sidecar_path(content_hash), 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_extracted(content_hash: str, unit: str, pages: List[str]):
+    offsets = []
+    pos = 0
+    for page in pages:
+        offsets.append(pos)
+        pos += len(page) + len(PAGE_SEPARATOR)
+    path = _sidecar_path(content_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump({"unit": unit, "offsets": offsets, "text": PAGE_SEPARATOR.join(pages)}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def remove_extracted(content_hash: Optional[str]):
+    if content_hash and os.path.exists(_sidecar_path(content_hash)):
+        os.remove(_sidecar_path(content_hash))
+
+def split_units(extracted: dict) -> List[str]:
+    text, offsets = extracted["text"], extracted["offsets"]
+    ends = [o - len(PAGE_SEPARATOR) for o in offsets[1:]] + [len(text)]
+    return [text[start:end] for start, end in zip(offsets, ends)]
+
+def iter_pages_cached(file_path: str, content_hash: Optional[str]) -> Iterator[str]:
+    # Same as iter_pages, but served from the sidecar when there is one and written to it
+    # once the file has been fully extracted
+    cached = load_extracted(content_hash)
+    if cached is not None:
+        yield from split_units(cached)
+        return
+    pages = []
+    for page in iter_pages(file_path):
+        pages.append(page)
+        yield page
+    if content_hash:
+        try:
+            _save_extracted(content_hash, _unit(file_path), pages)
+        except OSError as e:
+            print(f"Could not cache extracted text for {file_path}: {e}")
+
+def get_extracted(file_path: str, content_hash: str) -> dict:
+    cached = load_extracted(content_hash)
+    if cached is None:
+        for _ in iter_pages_cached(file_path, content_hash):
+            pass
+        cached = load_extracted(content_hash)
+    return cached
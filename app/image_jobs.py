@@ -0,0 +1,147 @@
+# app/image_jobs.py
+# Queue for image generation. Submitting returns a job id at once; IMAGE_QUEUE_WORKERS
+# workers take jobs off a bounded asyncio queue and run prompt compilation and image
+# generation (including the fallback model retry) outside the request. Progress and the
+# finished row are reported through the job registry (/api/jobs).
+import os
+import re
+import uuid
+import asyncio
+from typing import Callable, List, Optional, Tuple
+from PIL import Image
+from sqlmodel import Session, select
+
+from app.database import engine
+from app.jobs import jobs
+from app.media import make_derivatives, variant_urls
+from app.models import ProjectObject, Illustration
+from app.services import compile_image_prompt, generate_image_with_gemini, IMAGE_MAX_CONCURRENCY
+from app.utils import _safe_join_under
+
+MEDIA_ROOT = "media"
+IMAGE_QUEUE_WORKERS = int(os.environ.get("IMAGE_QUEUE_WORKERS", str(IMAGE_MAX_CONCURRENCY)))
+IMAGE_QUEUE_MAX_PENDING = int(os.environ.get("IMAGE_QUEUE_MAX_PENDING", "100"))
+
+_queue = None
+_workers = set()
+
+
+class ImageQueueFullError(RuntimeError):
+    pass
+
+
+def _save_image(folder: str, prefix: str, img_bytes: bytes) -> str:
+    # Runs in a worker thread: also writes the thumbnail and WebP derivatives
+    project_dir = os.path.join(MEDIA_ROOT, folder)
+    os.makedirs(project_dir, exist_ok=True)
+    filename = f"{prefix}_{uuid.uuid4().hex}.png"
+    path = os.path.join(project_dir, filename)
+    with open(path, "wb") as f:
+        f.write(img_bytes)
+    make_derivatives(path)
+    return f"/media/{folder}/{filename}"
+
+def load_project_objects(project_id: int) -> List[Tuple[str, str]]:
+    with Session(engine) as session:
+        return [(o.name, o.description) for o in session.exec(select(ProjectObject).where(ProjectObject.project_id == project_id)).all()]
+
+def consistency_notes_for(objects: List[Tuple[str, str]], desc: str) -> List[str]:
+    # Reference descriptions of the lab objects whose names appear in desc
+    return [f"- '{name}': {description}" for name, description in objects if re.search(r'\b' + re.escape(name) + r'\b', desc, re.IGNORECASE)]
+
+def _load_source_image(source_image_id: Optional[int]) -> Optional[Image.Image]:
+    if not source_image_id:
+        return None
+    with Session(engine) as session:
+        source_ill = session.get(Illustration, source_image_id)
+        source_file = source_ill.file_path if source_ill else None
+    if not source_file:
+        return None
+    full_path = _safe_join_under(MEDIA_ROOT, source_file.replace("/media/", ""))
+    if not os.path.exists(full_path):
+        return None
+    img = Image.open(full_path)
+    img.load()
+    return img
+
+def _store_illustration(project_id: int, rel_url: str, desc: str, style: str, scene_label: str,
+                        source_image_id: Optional[int]) -> dict:
+    with Session(engine) as session:
+        ill = Illustration(project_id=project_id, file_path=rel_url, prompt=desc, style=style, scene_label=scene_label, source_illustration_id=source_image_id)
+        session.add(ill)
+        session.commit()
+        session.refresh(ill)
+        return {"url": rel_url, "item": {**ill.model_dump(mode="json"), **variant_urls(rel_url)}}
+
+def _store_object(project_id: int, rel_url: str, name: str, description: str, style: str) -> dict:
+    with Session(engine) as session:
+        obj = ProjectObject(project_id=project_id, name=name, description=description, style=style, reference_image_path=rel_url)
+        session.add(obj)
+        session.commit()
+        session.refresh(obj)
+        return {"url": rel_url, "item": {**obj.model_dump(mode="json"), **variant_urls(rel_url)}}
+
+# Jobs run on the event loop, so database and file work goes through asyncio.to_thread
+async def render_illustration(project_id: int, desc: str, style: str = "", scene_label: str = "",
+                              source_image_id: Optional[int] = None, objects: Optional[List[Tuple[str, str]]] = None,
+                              on_status: Optional[Callable[[str], None]] = None) -> dict:
+    # Compiles the prompt, generates the image and stores the Illustration. objects can be
+    # passed in when many frames share one project's objects.
+    source_image_pil = await asyncio.to_thread(_load_source_image, source_image_id)
+    if objects is None:
+        objects = await asyncio.to_thread(load_project_objects, project_id)
+
+    final_prompt = await compile_image_prompt(f"A full scene. {desc}", style, consistency_notes_for(objects, desc))
+    if on_status:
+        on_status("generating")
+    img_bytes = await generate_image_with_gemini(final_prompt, source_image=source_image_pil)
+    rel_url = await asyncio.to_thread(_save_image, f"project_{project_id}", "img", img_bytes)
+    return await asyncio.to_thread(_store_illustration, project_id, rel_url, desc, style, scene_label, source_image_id)
+
+async def _render_illustration(job_id: str, project_id: int, desc: str, style: str, scene_label: str,
+                               source_image_id: Optional[int]) -> dict:
+    return await render_illustration(project_id, desc, style, scene_label, source_image_id,
+                                     on_status=lambda status: jobs.update(job_id, status=status))
+
+async def _render_object(job_id: str, project_id: int, name: str, description: str, style: str) -> dict:
+    raw_prompt = f"A single character reference image named '{name}'. {description}. Centered, plain white background, full body shot."
+    safe_prompt = await compile_image_prompt(raw_prompt, style)
+    jobs.update(job_id, status="generating")
+    img_bytes = await generate_image_with_gemini(safe_prompt)
+    rel_url = await asyncio.to_thread(_save_image, f"project_{project_id}_objects", "obj", img_bytes)
+    return await asyncio.to_thread(_store_object, project_id, rel_url, name, description, style)
+
+async def _worker():
+    while True:
+        job_id, render, args = await _queue.get()
+        try:
+            jobs.update(job_id, status="prompting")
+            result = await render(job_id, *args)
+            jobs.update(job_id, status="done", result=result)
+        except Exception as e:
+            print(f"Image job {job_id} failed: {e}")
+            jobs.update(job_id, status="failed", error=str(e))
+        finally:
+            _queue.task_done()
+
+def _submit(image_kind: str, project_id: int, label: str, render, *args) -> str:
+    # Must be called from the event loop (i.e. an async route)
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue(maxsize=IMAGE_QUEUE_MAX_PENDING)
+    while len(_workers) < IMAGE_QUEUE_WORKERS:
+        task = asyncio.create_task(_worker())
+        _workers.add(task)
+        task.add_done_callback(_workers.discard)
+    if _queue.full():
+        raise ImageQueueFullError("Too many images are queued, try again shortly.")
+    job_id = jobs.create("image", project_id=project_id, image_kind=image_kind, label=label[:120])
+    _queue.put_nowait((job_id, render, args))
+    return job_id
+
+def submit_illustration(project_id: int, desc: str, style: str = "", scene_label: str = "",
+                        source_image_id: Optional[int] = None) -> str:
+    return _submit("illustration", project_id, desc, _render_illustration, project_id, desc, style, scene_label, source_image_id)
+
+def submit_object(project_id: int, name: str, description: str, style: str = "") -> str:
+    return _submit("object", project_id, name, _render_object, project_id, name, description, style)
@@ -0,0 +1,183 @@
+# app/ingestion.py
+# Text extraction and embedding for uploaded files, run on a bounded worker pool so upload
+# requests return as soon as the bytes are on disk.
+import os
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from app.database import engine
+from app.jobs import jobs
+from app.models import LibraryFile, TempFile, ProjectLibraryLink
+from app.utils import VECTORSTORE_ROOT, create_vector_index_from_pages, remove_vector_index, _safe_join_under
+from app.extraction import iter_pages_cached, file_sha256, remove_extracted
+from app.project_index import sync_source, library_source, temp_source
+
+INGEST_MAX_WORKERS = int(os.environ.get("INGEST_MAX_WORKERS", "4"))
+LIBRARY_ROOT = "library"
+PENDING_STATES = ("queued", "extracting", "embedding")
+
+_pool = ThreadPoolExecutor(max_workers=INGEST_MAX_WORKERS, thread_name_prefix="ingest")
+
+
+def _set_state(job_id: str, model, row_id, state: str, **fields):
+    jobs.update(job_id, status=state)
+    with Session(engine) as session:
+        row = session.get(model, row_id)
+        if not row:
+            return
+        row.state = state
+        for k, v in fields.items():
+            setattr(row, k, v)
+        session.add(row)
+        session.commit()
+
+def _finish_library_file(job_id: str, file_id: int, content_hash: Optional[str], state: str, index_path) -> list:
+    # Marks the file and every pending row uploaded with the same bytes in a single UPDATE, so
+    # a duplicate upload is either finished here or, inserted after it, reads the final state
+    # of its original. Returns the ids of those sibling rows.
+    finished = LibraryFile.id == file_id
+    if content_hash:
+        finished = finished | ((LibraryFile.content_hash == content_hash) & LibraryFile.state.in_(PENDING_STATES))
+    with Session(engine) as session:
+        ids = session.execute(
+            update(LibraryFile).where(finished).values(state=state, vector_index_path=index_path).returning(LibraryFile.id)
+        ).scalars().all()
+        session.commit()
+    jobs.update(job_id, status=state)
+    return [i for i in ids if i != file_id]
+
+def _ingest_library_file(job_id: str, file_id: int):
+    try:
+        with Session(engine) as session:
+            rec = session.get(LibraryFile, file_id)
+            if not rec:
+                jobs.update(job_id, status="failed", error="File record not found")
+                return
+            uid_filename = rec.stored_path.replace("/library/", "", 1)
+            full_path = library_disk_path(rec.stored_path)
+            content_hash = rec.content_hash
+        if not content_hash:
+            # Rows from before hashes were recorded
+            content_hash = file_sha256(full_path)
+
+        _set_state(job_id, LibraryFile, file_id, "extracting", content_hash=content_hash)
+        index_dir = os.path.join(VECTORSTORE_ROOT, "library")
+        os.makedirs(index_dir, exist_ok=True)
+        index_path = os.path.join(index_dir, uid_filename.replace('.', '_'))
+        # Chunks are embedded while later pages are still being extracted
+        if not create_vector_index_from_pages(iter_pages_cached(full_path, content_hash), index_path,
+                                              lambda: _set_state(job_id, LibraryFile, file_id, "embedding")):
+            index_path = None
+        siblings = _finish_library_file(job_id, file_id, content_hash, "done", index_path)
+
+        # The files may have been linked to projects while they were still being processed
+        file_ids = [file_id, *siblings]
+        with Session(engine) as session:
+            links = session.exec(select(ProjectLibraryLink).where(ProjectLibraryLink.file_id.in_(file_ids))).all()
+            pairs = [(l.project_id, l.file_id) for l in links]
+        for pid, fid in pairs:
+            sync_source(pid, library_source(fid), index_path)
+        jobs.update(job_id, result={"file_id": file_id, "indexed": index_path is not None})
+    except Exception as e:
+        print(f"Failed to ingest library file {file_id}: {e}")
+        jobs.update(job_id, error=str(e))
+        with Session(engine) as session:
+            rec = session.get(LibraryFile, file_id)
+            content_hash = rec.content_hash if rec else None
+        _finish_library_file(job_id, file_id, content_hash, "failed", None)
+
+def _ingest_temp_file(job_id: str, temp_id: str):
+    try:
+        with Session(engine) as session:
+            rec = session.get(TempFile, temp_id)
+            if not rec:
+                jobs.update(job_id, status="failed", error="File record not found")
+                return
+            project_id, stored_path, content_hash = rec.project_id, rec.stored_path, rec.content_hash
+
+        _set_state(job_id, TempFile, temp_id, "extracting")
+        index_dir = os.path.join(VECTORSTORE_ROOT, f"project_{project_id}", "temp")
+        os.makedirs(index_dir, exist_ok=True)
+        index_path = os.path.join(index_dir, os.path.basename(stored_path))
+        if not create_vector_index_from_pages(iter_pages_cached(stored_path, content_hash), index_path,
+                                              lambda: _set_state(job_id, TempFile, temp_id, "embedding")):
+            index_path = None
+        _set_state(job_id, TempFile, temp_id, "done", vector_index_path=index_path)
+        sync_source(project_id, temp_source(temp_id), index_path)
+        jobs.update(job_id, result={"file_id": temp_id, "indexed": index_path is not None})
+    except Exception as e:
+        print(f"Failed to ingest temp file {temp_id}: {e}")
+        jobs.update(job_id, error=str(e))
+        _set_state(job_id, TempFile, temp_id, "failed")
+
+def submit_library_file(file_id: int, filename: str = "") -> str:
+    job_id = jobs.create("library_ingest", file_id=file_id, filename=filename)
+    _pool.submit(_ingest_library_file, job_id, file_id)
+    return job_id
+
+def submit_temp_file(temp_id: str, filename: str = "") -> str:
+    job_id = jobs.create("temp_ingest", file_id=temp_id, filename=filename)
+    _pool.submit(_ingest_temp_file, job_id, temp_id)
+    return job_id
+
+def library_job_for(content_hash: str) -> Optional[str]:
+    # Returns the running job that is processing these bytes, whichever row started it
+    with Session(engine) as session:
+        owner_ids = session.exec(select(LibraryFile.id).where(LibraryFile.content_hash == content_hash)).all()
+    for owner_id in owner_ids:
+        job_id = jobs.find_active("library_ingest", file_id=owner_id)
+        if job_id:
+            return job_id
+    return None
+
+def library_disk_path(stored_path: str) -> str:
+    return _safe_join_under(LIBRARY_ROOT, stored_path.replace("/library/", "", 1))
+
+def release_assets(disk_path: str, vector_index_path: str, content_hash: str = None):
+    # Removes a stored file, its vector index and its extracted text once no library or temp
+    # row points at them any more. Library rows store a /library/ URL; temp rows store the
+    # disk path, which is also what a temp row reusing a library file holds.
+    library_root = os.path.abspath(LIBRARY_ROOT)
+    library_url = None
+    if disk_path and os.path.dirname(os.path.abspath(disk_path)) == library_root:
+        library_url = f"/library/{os.path.basename(disk_path)}"
+    with Session(engine) as session:
+        file_refs = session.exec(select(TempFile.id).where(TempFile.stored_path == disk_path)).all() if disk_path else []
+        if library_url:
+            file_refs += session.exec(select(LibraryFile.id).where(LibraryFile.stored_path == library_url)).all()
+        index_refs = []
+        if vector_index_path:
+            index_refs = session.exec(select(LibraryFile.id).where(LibraryFile.vector_index_path == vector_index_path)).all()
+            index_refs += session.exec(select(TempFile.id).where(TempFile.vector_index_path == vector_index_path)).all()
+        hash_refs = []
+        if content_hash:
+            hash_refs = session.exec(select(LibraryFile.id).where(LibraryFile.content_hash == content_hash)).all()
+            hash_refs += session.exec(select(TempFile.id).where(TempFile.content_hash == content_hash)).all()
+    if disk_path and not file_refs and os.path.exists(disk_path):
+        os.remove(disk_path)
+    if vector_index_path and not index_refs:
+        remove_vector_index(vector_index_path)
+    if content_hash and not hash_refs:
+        remove_extracted(content_hash)
+
+def resume_pending_ingestion():
+    # Jobs live in memory, so files left mid-pipeline by a restart are queued again. Rows
+    # that share their bytes with an earlier pending row are finished by that row's job.
+    with Session(engine) as session:
+        library_rows = session.exec(select(LibraryFile).where(LibraryFile.state.in_(PENDING_STATES))).all()
+        seen = set()
+        unique_rows = []
+        for r in library_rows:
+            if r.content_hash and r.content_hash in seen:
+                continue
+            seen.add(r.content_hash)
+            unique_rows.append(r)
+        library_rows = unique_rows
+        temp_rows = session.exec(select(TempFile).where(TempFile.state.in_(PENDING_STATES))).all()
+        pending = [(r.id, r.filename) for r in library_rows], [(r.id, r.original_filename) for r in temp_rows]
+    for file_id, name in pending[0]:
+        submit_library_file(file_id, name)
+    for temp_id, name in pending[1]:
+        submit_temp_file(temp_id, name)
@@ -0,0 +1,64 @@
+# app/jobs.py
+# In-memory registry for work that outlives the HTTP request that started it. Jobs are
+# tracked by id with a status string, an optional progress dict and a result or error.
+import uuid
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional
+
+MAX_FINISHED_JOBS = 1000
+FINISHED_STATES = {"done", "failed"}
+
+
+class JobRegistry:
+    def __init__(self, max_finished: int = MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, kind: str, status: str = "queued", **meta) -> str:
+        job_id = uuid.uuid4().hex
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            self._jobs[job_id] = {
+                "id": job_id, "kind": kind, "status": status, "progress": {},
+                "result": None, "error": None, "created_at": now, "updated_at": now, **meta,
+            }
+            self._prune()
+        return job_id
+
+    def update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return
+            job.update(fields)
+            job["updated_at"] = datetime.utcnow().isoformat()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def find_active(self, kind: str, **meta) -> Optional[str]:
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job["kind"] == kind and job["status"] not in FINISHED_STATES and \
+                        all(job.get(k) == v for k, v in meta.items()):
+                    return job["id"]
+        return None
+
+    def list_active(self, kind: str, **meta) -> List[dict]:
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()
+                    if job["kind"] == kind and job["status"] not in FINISHED_STATES and
+                    all(job.get(k) == v for k, v in meta.items())]
+
+    def _prune(self):
+        finished = [jid for jid, j in self._jobs.items() if j["status"] in FINISHED_STATES]
+        for jid in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[jid]
+
+
+jobs = JobRegistry()
@@ -2,25 +2,31 @@
 import os
 import uvicorn
 from fastapi import FastAPI, Request
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 
 from app.database import create_db_and_tables
-from app.routes import projects, chat, notes, synopsis, illustrations, review, library, rules, outlines
+from app.ingestion import resume_pending_ingestion
+from app.media import MediaFiles
+from app.static_files import CachedStaticFiles, PrecompressedStaticFiles, precompress_static
+from app.upload_limit import UploadLimitMiddleware
+from app.routes import projects, chat, notes, synopsis, illustrations, review, library, rules, outlines, system, jobs
 
 # Create all database tables on startup
 create_db_and_tables()
+resume_pending_ingestion()
 
 app = FastAPI()
+app.add_middleware(UploadLimitMiddleware)
 
 # Mount static files
 os.makedirs("static", exist_ok=True)
 os.makedirs("media", exist_ok=True)
 os.makedirs("library", exist_ok=True)
-app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/media", StaticFiles(directory="media"), name="media")
-app.mount("/library", StaticFiles(directory="library"), name="library")
+print(f"Precompressed {precompress_static('static')} static assets")
+app.mount("/static", PrecompressedStaticFiles(directory="static"), name="static")
+app.mount("/media", MediaFiles(directory="media"), name="media")
+app.mount("/library", CachedStaticFiles(directory="library"), name="library")
 
 templates = Jinja2Templates(directory="templates")
 
@@ -34,6 +40,8 @@ app.include_router(review.router)
 app.include_router(library.router)
 app.include_router(rules.router)
 app.include_router(outlines.router)
+app.include_router(system.router)
+app.include_router(jobs.router)
 
 # The main home page route remains here
 @app.get("/", response_class=HTMLResponse)
@@ -0,0 +1,104 @@
+# app/media.py
+# Derivatives of generated images: a WebP thumbnail for grid views plus full-size WebP and,
+# when Pillow is built with it, AVIF copies. They sit next to the original as
+# <name>.thumb.webp, <name>.webp and <name>.avif. The thumbnail and WebP are written as soon
+# as an image is generated; anything missing (older images, AVIF) is created on its first
+# request by MediaFiles and kept on disk from then on.
+import os
+import threading
+from typing import Optional
+from PIL import Image, features
+from fastapi.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+
+from app.static_files import CachedStaticFiles
+from app.utils import _safe_join_under
+
+THUMB_MAX_PX = int(os.environ.get("THUMB_MAX_PX", "480"))
+THUMB_QUALITY = int(os.environ.get("THUMB_QUALITY", "75"))
+WEBP_QUALITY = int(os.environ.get("WEBP_QUALITY", "82"))
+AVIF_QUALITY = int(os.environ.get("AVIF_QUALITY", "60"))
+AVIF_SUPPORTED = features.check("avif")
+
+VARIANT_SUFFIXES = {"thumb": ".thumb.webp", "webp": ".webp"}
+if AVIF_SUPPORTED:
+    VARIANT_SUFFIXES["avif"] = ".avif"
+EAGER_VARIANTS = ("thumb", "webp")
+ORIGINAL_EXTS = (".png", ".jpg", ".jpeg")
+
+
+def variant_path(original: str, variant: str) -> str:
+    # Works on both disk paths and /media URLs
+    return os.path.splitext(original)[0] + VARIANT_SUFFIXES[variant]
+
+def variant_urls(url: Optional[str]) -> dict:
+    # {"thumb_url", "webp_url", "avif_url"} for a /media URL; None values when there is no image
+    return {f"{variant}_url": variant_path(url, variant) if url and variant in VARIANT_SUFFIXES else None
+            for variant in ("thumb", "webp", "avif")}
+
+def make_variant(original_path: str, variant: str) -> str:
+    target = variant_path(original_path, variant)
+    with Image.open(original_path) as img:
+        img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+        if variant == "thumb":
+            img.thumbnail((THUMB_MAX_PX, THUMB_MAX_PX))
+            options = {"format": "WEBP", "quality": THUMB_QUALITY, "method": 4}
+        elif variant == "webp":
+            options = {"format": "WEBP", "quality": WEBP_QUALITY, "method": 4}
+        else:
+            options = {"format": "AVIF", "quality": AVIF_QUALITY}
+        tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        img.save(tmp_path, **options)
+    os.replace(tmp_path, target)
+    return target
+
+def make_derivatives(original_path: str):
+    for variant in EAGER_VARIANTS:
+        try:
+            make_variant(original_path, variant)
+        except Exception as e:
+            print(f"Could not create {variant} for {original_path}: {e}")
+
+def remove_derivatives(original_path: str):
+    for variant in VARIANT_SUFFIXES:
+        path = variant_path(original_path, variant)
+        if os.path.exists(path):
+            os.remove(path)
+
+def _parse_variant(path: str):
+    # "project_1/img_x.thumb.webp" -> ("project_1/img_x", "thumb")
+    for variant, suffix in sorted(VARIANT_SUFFIXES.items(), key=lambda kv: -len(kv[1])):
+        if path.endswith(suffix):
+            return path[:-len(suffix)], variant
+    return None, None
+
+
+class MediaFiles(CachedStaticFiles):
+    # Immutable static files that create a missing derivative from its original on first request
+
+    async def get_response(self, path: str, scope):
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+            stem, variant = _parse_variant(path)
+            original = self._find_original(stem) if stem else None
+            if not original:
+                raise
+            try:
+                await run_in_threadpool(make_variant, original, variant)
+            except Exception as make_error:
+                print(f"Could not create {variant} for {original}: {make_error}")
+                raise e
+            return await super().get_response(path, scope)
+
+    def _find_original(self, stem: str) -> Optional[str]:
+        for ext in ORIGINAL_EXTS:
+            try:
+                candidate = _safe_join_under(str(self.directory), stem + ext)
+            except Exception:
+                return None
+            if os.path.isfile(candidate):
+                return candidate
+        return None
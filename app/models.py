@@ -2,12 +2,13 @@
 import uuid
 from datetime import datetime
 from typing import Optional
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
 # (כל הקלאסים של SQLModel שהיו ב-main.py הועברו לכאן)
-# Project, SynopsisHistory, ProjectObject, History, GeneralNotes,
+# Project, SynopsisHistory, ProjectObject, History, ConversationSummary, GeneralNotes,
 # ChapterOutline, Rule, Illustration, Review, ReviewDiscussion,
-# LibraryFile, ProjectLibraryLink, TempFile
+# ReviewChunk, LibraryFile, ProjectLibraryLink, TempFile
 
 class Project(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -25,12 +26,16 @@ class Project(SQLModel, table=True):
     synopsis_draft_discussion: str = Field(default="[]")
 
 class SynopsisHistory(SQLModel, table=True):
+    __table_args__ = (Index("ix_synopsishistory_project_created", "project_id", "created_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     project_id: int = Field(foreign_key="project.id")
     text: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ProjectObject(SQLModel, table=True):
+    __table_args__ = (Index("ix_projectobject_project_created", "project_id", "created_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     project_id: int = Field(foreign_key="project.id")
     name: str
@@ -40,20 +45,32 @@ class ProjectObject(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class History(SQLModel, table=True):
+    __table_args__ = (Index("ix_history_project_created", "project_id", "created_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     project_id: int = Field(foreign_key="project.id")
     question: str
     answer: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class ConversationSummary(SQLModel, table=True):
+    # Rolling summary of a project's chat history up to and including last_history_id
+    id: Optional[int] = Field(default=None, primary_key=True)
+    project_id: int = Field(foreign_key="project.id", index=True, unique=True)
+    summary: str = Field(default="")
+    last_history_id: int = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
 class GeneralNotes(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    project_id: int = Field(foreign_key="project.id")
+    project_id: int = Field(foreign_key="project.id", index=True)
     text: str = ""
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     vector_index_path: Optional[str] = Field(default=None)
 
 class ChapterOutline(SQLModel, table=True):
+    __table_args__ = (Index("ix_chapteroutline_project_title", "project_id", "chapter_title"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     project_id: int = Field(foreign_key="project.id")
     chapter_title: str
@@ -63,12 +80,14 @@ class ChapterOutline(SQLModel, table=True):
 
 class Rule(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    project_id: Optional[int] = Field(default=None, foreign_key="project.id")
+    project_id: Optional[int] = Field(default=None, foreign_key="project.id", index=True)
     text: str
     mode: str = Field(default="enforce")
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Illustration(SQLModel, table=True):
+    __table_args__ = (Index("ix_illustration_project_created", "project_id", "created_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     project_id: int = Field(foreign_key="project.id")
     file_path: str
@@ -79,6 +98,8 @@ class Illustration(SQLModel, table=True):
     source_illustration_id: Optional[int] = Field(default=None, foreign_key="illustration.id")
 
 class Review(SQLModel, table=True):
+    __table_args__ = (Index("ix_review_project_created", "project_id", "created_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     project_id: int = Field(foreign_key="project.id")
     kind: str
@@ -90,6 +111,8 @@ class Review(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ReviewDiscussion(SQLModel, table=True):
+    __table_args__ = (Index("ix_reviewdiscussion_review_created", "review_id", "created_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     project_id: int = Field(foreign_key="project.id")
     review_id: int = Field(foreign_key="review.id")
@@ -97,25 +120,46 @@ class ReviewDiscussion(SQLModel, table=True):
     message: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class ReviewChunk(SQLModel, table=True):
+    # Review of one chunk of a manuscript, keyed by a hash of the chunk's text, the review kind
+    # and the project rules, so unchanged chapters are not sent to the model again
+    __table_args__ = (Index("ix_reviewchunk_project_key", "project_id", "chunk_key", unique=True),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    project_id: int = Field(foreign_key="project.id")
+    kind: str
+    chunk_key: str
+    result: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_used_at: datetime = Field(default_factory=datetime.utcnow)
+
 class LibraryFile(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     filename: str
     stored_path: str
     ext: str
     size: int = 0
-    uploaded_at: datetime = Field(default_factory=datetime.utcnow)
+    uploaded_at: datetime = Field(default_factory=datetime.utcnow, index=True)
     vector_index_path: Optional[str] = Field(default=None)
+    # queued -> extracting -> embedding -> done | failed
+    state: str = Field(default="done")
+    # sha256 of the bytes; rows with the same hash share the stored file and vector index
+    content_hash: Optional[str] = Field(default=None, index=True)
 
 class ProjectLibraryLink(SQLModel, table=True):
+    __table_args__ = (Index("ix_projectlibrarylink_project_file", "project_id", "file_id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     project_id: int = Field(foreign_key="project.id")
-    file_id: int = Field(foreign_key="libraryfile.id")
+    file_id: int = Field(foreign_key="libraryfile.id", index=True)
     linked_at: datetime = Field(default_factory=datetime.utcnow)
 
 class TempFile(SQLModel, table=True):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
-    project_id: int
+    project_id: int = Field(index=True)
     original_filename: str
     stored_path: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
     vector_index_path: Optional[str] = Field(default=None)
+    state: str = Field(default="done")
+    content_hash: Optional[str] = Field(default=None, index=True)
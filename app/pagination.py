@@ -0,0 +1,40 @@
+# app/pagination.py
+# Keyset pagination for the list endpoints. Pages run newest first by (created_at, id); a
+# client asks for the next page by passing the id of the last row it has as before_id.
+# Only the requested columns are selected, so heavy text fields stay out of list views.
+import os
+from datetime import datetime
+from typing import Optional, Sequence
+from sqlalchemy import and_, or_
+from sqlmodel import Session, select
+
+PAGE_DEFAULT_LIMIT = int(os.environ.get("PAGE_DEFAULT_LIMIT", "50"))
+PAGE_MAX_LIMIT = int(os.environ.get("PAGE_MAX_LIMIT", "200"))
+
+
+def parse_fields(fields: str, allowed: Sequence[str], default: Sequence[str]) -> list:
+    # "a,b" -> the allowed subset, always including id; empty -> default
+    wanted = [f.strip() for f in (fields or "").split(",") if f.strip() in allowed]
+    return list(dict.fromkeys(["id", *(wanted or default)]))
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def keyset_page(session: Session, model, where: list, fields: Sequence[str], before_id: Optional[int] = None,
+                limit: int = PAGE_DEFAULT_LIMIT, order_field: str = "created_at") -> dict:
+    order_col = getattr(model, order_field)
+    query = select(*[getattr(model, f) for f in fields]).where(*where)
+    if before_id is not None:
+        cursor = session.exec(select(order_col).where(model.id == before_id)).first()
+        if cursor is not None:
+            query = query.where(or_(order_col < cursor, and_(order_col == cursor, model.id < before_id)))
+        else:
+            query = query.where(model.id < before_id)
+    limit = max(1, min(limit, PAGE_MAX_LIMIT))
+    # execute() rather than exec(): a single-column select would otherwise yield bare scalars
+    rows = session.execute(query.order_by(order_col.desc(), model.id.desc()).limit(limit + 1)).all()
+    items = [{f: _json_value(v) for f, v in zip(fields, row)} for row in rows[:limit]]
+    return {
+        "items": items,
+        "next_before_id": items[-1]["id"] if len(rows) > limit else None,
+    }
@@ -0,0 +1,196 @@
+# app/project_index.py
+# One composite FAISS index per project holding the vectors of its General Notes, linked
+# library files and temp files. Docstore ids are "<source_id>|<chunk sha256>" and every
+# document carries {"source": source_id}, so a source can be synced or dropped in place and
+# a single search covers all of a project's material. sources.json in the index folder
+# records which source index each source was last synced from.
+import os
+import json
+import threading
+from collections import defaultdict
+from typing import List, Optional
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from sqlmodel import Session, select
+
+from app.database import engine
+from app.models import GeneralNotes, ProjectLibraryLink, LibraryFile, TempFile
+from app.utils import VECTORSTORE_ROOT, embeddings, index_cache, _chunk_id
+
+NOTES_SOURCE = "notes"
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "8"))
+RETRIEVAL_SOURCE_CHAR_BUDGET = int(os.environ.get("RETRIEVAL_SOURCE_CHAR_BUDGET", "4000"))
+
+_locks = defaultdict(threading.Lock)
+
+
+def library_source(file_id: int) -> str:
+    return f"library:{file_id}"
+
+def temp_source(temp_id: str) -> str:
+    return f"temp:{temp_id}"
+
+def project_index_path(project_id: int) -> str:
+    return os.path.join(VECTORSTORE_ROOT, f"project_{project_id}", "project_index")
+
+def _exists(index_path: str) -> bool:
+    return os.path.exists(os.path.join(index_path, "index.faiss"))
+
+def _manifest_path(index_path: str) -> str:
+    return os.path.join(index_path, "sources.json")
+
+def _read_manifest(index_path: str) -> dict:
+    # {source_id: source index path}; empty for composites built before it was kept
+    try:
+        with open(_manifest_path(index_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_manifest(index_path: str, manifest: dict):
+    os.makedirs(index_path, exist_ok=True)
+    tmp_path = f"{_manifest_path(index_path)}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, _manifest_path(index_path))
+
+def _record_synced(index_path: str, source_id: str, source_index_path: Optional[str]):
+    manifest = _read_manifest(index_path)
+    if source_index_path:
+        if manifest.get(source_id) == source_index_path:
+            return
+        manifest[source_id] = source_index_path
+    elif source_id in manifest:
+        del manifest[source_id]
+    else:
+        return
+    _write_manifest(index_path, manifest)
+
+def _source_entries(index_path: str) -> dict:
+    # Reads (text, vector) pairs back out of a per-file index, keyed by chunk hash, so the
+    # composite is filled without calling the embedding API again.
+    db = index_cache.get(index_path) if index_path else None
+    if db is None:
+        return {}
+    entries = {}
+    for pos, doc_id in db.index_to_docstore_id.items():
+        doc = db.docstore.search(doc_id)
+        if not hasattr(doc, "page_content"):
+            continue
+        entries.setdefault(_chunk_id(doc.page_content), (doc.page_content, db.index.reconstruct(int(pos))))
+    return entries
+
+def sync_source(project_id: int, source_id: str, source_index_path: Optional[str]):
+    # Makes the composite hold exactly the chunks of source_index_path under source_id
+    # (or none of them when the path is None/missing).
+    wanted = _source_entries(source_index_path)
+    path = project_index_path(project_id)
+    with _locks[project_id]:
+        prefix = f"{source_id}|"
+        if _exists(path):
+            db = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+            existing = {doc_id for doc_id in db.index_to_docstore_id.values() if doc_id.startswith(prefix)}
+        else:
+            db = None
+            existing = set()
+        stale = [doc_id for doc_id in existing if doc_id[len(prefix):] not in wanted]
+        fresh = [(h, entry) for h, entry in wanted.items() if f"{prefix}{h}" not in existing]
+        if not stale and not fresh:
+            _record_synced(path, source_id, source_index_path)
+            return
+        if stale:
+            db.delete(stale)
+        if fresh:
+            pairs = [(text, [float(x) for x in vec]) for _, (text, vec) in fresh]
+            metadatas = [{"source": source_id} for _ in fresh]
+            ids = [f"{prefix}{h}" for h, _ in fresh]
+            if db is None:
+                db = FAISS.from_embeddings(pairs, embeddings, metadatas=metadatas, ids=ids)
+            else:
+                db.add_embeddings(pairs, metadatas=metadatas, ids=ids)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        db.save_local(path)
+        index_cache.invalidate(path)
+        _record_synced(path, source_id, source_index_path)
+
+def remove_source(project_id: int, source_id: str):
+    sync_source(project_id, source_id, None)
+
+def ensure_project_index(project_id: int):
+    # Backfills every indexed source of the project that the manifest does not list as
+    # synced from its current index, e.g. material added before the composite existed.
+    with Session(engine) as session:
+        gn = session.exec(select(GeneralNotes).where(GeneralNotes.project_id == project_id)).first()
+        links = session.exec(select(ProjectLibraryLink).where(ProjectLibraryLink.project_id == project_id)).all()
+        files = session.exec(select(LibraryFile).where(LibraryFile.id.in_([l.file_id for l in links]))).all() if links else []
+        temps = session.exec(select(TempFile).where(TempFile.project_id == project_id)).all()
+        sources = [(library_source(lf.id), lf.vector_index_path) for lf in files]
+        sources += [(temp_source(tf.id), tf.vector_index_path) for tf in temps]
+        if gn:
+            sources.append((NOTES_SOURCE, gn.vector_index_path))
+    synced = _read_manifest(project_index_path(project_id))
+    for source_id, source_index_path in sources:
+        # Sources still being ingested are synced when their ingestion finishes
+        if source_index_path and synced.get(source_id) != source_index_path:
+            sync_source(project_id, source_id, source_index_path)
+
+def _search_index(db, query_vector, k: int, positions: Optional[list] = None) -> list:
+    # [(distance, doc)] from one FAISS store, optionally restricted to positions
+    if positions is not None:
+        if not positions:
+            return []
+        params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(np.array(positions, dtype=np.int64)))
+        distances, indices = db.index.search(query_vector, min(len(positions), k), params=params)
+    else:
+        distances, indices = db.index.search(query_vector, min(db.index.ntotal, k))
+    hits = []
+    for dist, pos in zip(distances[0], indices[0]):
+        if pos < 0:
+            break
+        doc = db.docstore.search(db.index_to_docstore_id[int(pos)])
+        if hasattr(doc, "page_content"):
+            hits.append((float(dist), doc))
+    return hits
+
+def search_project_index(project_id: int, query: str, source_ids: List[str], k: int = RETRIEVAL_TOP_K,
+                         per_source_chars: int = RETRIEVAL_SOURCE_CHAR_BUDGET,
+                         extra_indexes: Optional[dict] = None) -> list:
+    # Returns [(source_id, text)] ranked by L2 distance, restricted to source_ids, with no
+    # source contributing more than per_source_chars characters. extra_indexes maps source ids
+    # that are not part of the composite (library files attached to a single question) to
+    # their own index, which is searched alongside it.
+    extra_indexes = extra_indexes or {}
+    if not (source_ids or extra_indexes) or not query.strip():
+        return []
+    # Over-fetch so the per-source budget can skip hits and still fill k
+    fetch = k * 4
+    candidates = []
+    query_vector = None
+    db = index_cache.get(project_index_path(project_id)) if source_ids else None
+    if db is not None and db.index.ntotal > 0:
+        wanted = set(source_ids)
+        positions = [pos for pos, doc_id in db.index_to_docstore_id.items() if doc_id.split("|", 1)[0] in wanted]
+        if positions:
+            query_vector = np.array([embeddings.embed_query(query)], dtype=np.float32)
+            candidates += [(dist, doc.metadata.get("source", ""), doc.page_content)
+                           for dist, doc in _search_index(db, query_vector, fetch, positions)]
+    for source_id, index_path in extra_indexes.items():
+        extra_db = index_cache.get(index_path) if index_path else None
+        if extra_db is None or extra_db.index.ntotal == 0:
+            continue
+        if query_vector is None:
+            query_vector = np.array([embeddings.embed_query(query)], dtype=np.float32)
+        candidates += [(dist, source_id, doc.page_content) for dist, doc in _search_index(extra_db, query_vector, fetch)]
+    candidates.sort(key=lambda c: c[0])
+
+    used = {}
+    merged = []
+    for _, source, text in candidates:
+        if len(merged) >= k:
+            break
+        if used.get(source, 0) + len(text) > per_source_chars:
+            continue
+        used[source] = used.get(source, 0) + len(text)
+        merged.append((source, text))
+    return merged
@@ -0,0 +1,109 @@
+# app/prompt_budget.py
+# Fits the sections of a prompt into a token budget. Sizes are a local estimate (no API
+# call): Gemini's tokenizer averages roughly 4 characters per token on Latin text and fewer
+# on Hebrew, so non-ASCII characters are weighted more heavily. Each section may have its
+# own cap; if the total is still over budget, the lowest-priority sections are cut first.
+# Required sections (rules, the request itself) are counted but never cut.
+import os
+import math
+from typing import List, Optional, Tuple, Union
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "32000"))
+CHARS_PER_TOKEN_ASCII = 4.0
+CHARS_PER_TOKEN_OTHER = 2.5
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return math.ceil(ascii_chars / CHARS_PER_TOKEN_ASCII + (len(text) - ascii_chars) / CHARS_PER_TOKEN_OTHER)
+
+
+class PromptSection:
+    # text is either a string or a list of items (retrieved chunks, history turns) joined
+    # with separator; lists are cut by whole items before any item is cut mid-text.
+    # keep="head" keeps the start (ranked hits), keep="tail" keeps the end (recent turns).
+
+    def __init__(self, name: str, text: Union[str, List[str]], priority: int = 0, max_tokens: Optional[int] = None,
+                 keep: str = "head", separator: str = "\n", required: bool = False):
+        self.name = name
+        self.items = list(text) if isinstance(text, list) else None
+        self.text = separator.join(self.items) if self.items is not None else (text or "")
+        self.priority = priority
+        self.max_tokens = max_tokens
+        self.keep = keep
+        self.separator = separator
+        self.required = required
+        self.original_tokens = estimate_tokens(self.text)
+        self.tokens = self.original_tokens
+
+    def cut_to(self, target: int):
+        target = max(0, target)
+        if self.tokens <= target:
+            return
+        if self.items is not None:
+            items = self.items if self.keep == "head" else list(reversed(self.items))
+            kept, used = [], 0
+            for item in items:
+                cost = estimate_tokens(item) + estimate_tokens(self.separator)
+                if used + cost > target:
+                    break
+                kept.append(item)
+                used += cost
+            if not kept and items and target > 0:
+                # Not even one whole item fits: keep part of the best one
+                kept = [_cut_text(items[0], target, self.keep)]
+            self.items = kept if self.keep == "head" else list(reversed(kept))
+            self.text = self.separator.join(self.items)
+        else:
+            self.text = _cut_text(self.text, target, self.keep)
+        self.tokens = estimate_tokens(self.text)
+
+
+def _cut_text(text: str, target: int, keep: str) -> str:
+    if target <= 0:
+        return ""
+    tokens = estimate_tokens(text)
+    chars = int(len(text) * target / tokens) if tokens else 0
+    while chars > 0:
+        piece = text[:chars] if keep == "head" else text[-chars:]
+        if estimate_tokens(piece) <= target:
+            break
+        chars = int(chars * 0.9)
+    if chars <= 0:
+        return ""
+    piece = text[:chars] if keep == "head" else text[-chars:]
+    # End on a word boundary rather than mid-word
+    if keep == "head" and chars < len(text) and " " in piece:
+        piece = piece[:piece.rfind(" ")]
+    elif keep == "tail" and chars < len(text) and " " in piece:
+        piece = piece[piece.find(" ") + 1:]
+    return piece
+
+
+def fit_to_budget(sections: List[PromptSection], budget: int = PROMPT_TOKEN_BUDGET) -> Tuple[dict, dict]:
+    # Returns ({name: fitted text}, report) where the report gives, per section, the
+    # estimated tokens before and after fitting.
+    for section in sections:
+        if section.max_tokens is not None and not section.required:
+            section.cut_to(section.max_tokens)
+
+    overflow = sum(s.tokens for s in sections) - budget
+    for section in sorted((s for s in sections if not s.required), key=lambda s: s.priority):
+        if overflow <= 0:
+            break
+        before = section.tokens
+        section.cut_to(section.tokens - overflow)
+        overflow -= before - section.tokens
+
+    report = {
+        "budget": budget,
+        "total": sum(s.tokens for s in sections),
+        "over_budget": max(0, overflow),
+        "sections": {
+            s.name: {"tokens": s.tokens, "original_tokens": s.original_tokens, "truncated": s.tokens < s.original_tokens}
+            for s in sections
+        },
+    }
+    return {s.name: s.text for s in sections}, report
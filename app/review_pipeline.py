@@ -0,0 +1,173 @@
+# app/review_pipeline.py
+# Map-reduce review for manuscripts too long for one prompt. The text is split on chapter
+# headings, the chunks are reviewed concurrently (at most REVIEW_MAX_CONCURRENCY at a time
+# per review) and the partial reviews are synthesized into one report. Chunk results are
+# stored in ReviewChunk under a hash of the chunk text, kind and rules, so a rerun, whether
+# after a failure or after editing a few chapters, only sends the changed chunks to the model.
+import os
+import re
+import asyncio
+import hashlib
+from datetime import datetime
+from typing import List
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select, delete
+
+from app.database import engine
+from app.jobs import jobs
+from app.models import Review, ReviewChunk
+from app.services import generate_text, build_rules_preamble
+from prompts import (create_general_review_prompt, create_proofread_prompt,
+                     create_review_chunk_prompt, create_review_synthesis_prompt)
+
+REVIEW_SINGLE_MAX_CHARS = int(os.environ.get("REVIEW_SINGLE_MAX_CHARS", "24000"))
+REVIEW_CHUNK_MAX_CHARS = int(os.environ.get("REVIEW_CHUNK_MAX_CHARS", "12000"))
+REVIEW_MAX_CONCURRENCY = int(os.environ.get("REVIEW_MAX_CONCURRENCY", "4"))
+REVIEW_CHUNK_CACHE_MAX_PER_PROJECT = int(os.environ.get("REVIEW_CHUNK_CACHE_MAX_PER_PROJECT", "2000"))
+CHAPTER_HEADING = re.compile(r"^[ \t]*פרק\s+\d+", re.MULTILINE)
+
+# Running review tasks, referenced here so they are not garbage-collected mid-run
+_tasks = set()
+
+
+def _split_long(text: str, max_chars: int) -> List[str]:
+    # Packs paragraphs into pieces of at most max_chars; a longer paragraph is cut hard
+    pieces, current = [], ""
+    for para in text.split("\n\n"):
+        candidate = f"{current}\n\n{para}" if current else para
+        if len(candidate) <= max_chars:
+            current = candidate
+            continue
+        if current:
+            pieces.append(current)
+        while len(para) > max_chars:
+            pieces.append(para[:max_chars])
+            para = para[max_chars:]
+        current = para
+    if current:
+        pieces.append(current)
+    return pieces
+
+def split_manuscript(text: str, max_chars: int = REVIEW_CHUNK_MAX_CHARS) -> List[str]:
+    # One chunk per chapter ("פרק N" at the start of a line); chapters longer than
+    # max_chars are split further on paragraph boundaries
+    starts = [m.start() for m in CHAPTER_HEADING.finditer(text)]
+    if not starts or starts[0] > 0:
+        starts = [0] + starts
+    chunks = []
+    for start, end in zip(starts, starts[1:] + [len(text)]):
+        section = text[start:end].strip()
+        if section:
+            chunks.extend(_split_long(section, max_chars))
+    return chunks
+
+def _chunk_key(kind: str, rules: str, chunk: str) -> str:
+    raw = f"{kind}|{rules}|{chunk}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _prune_chunks(project_id: int):
+    with Session(engine) as session:
+        stale = session.exec(
+            select(ReviewChunk.id).where(ReviewChunk.project_id == project_id)
+            .order_by(ReviewChunk.last_used_at.desc()).offset(REVIEW_CHUNK_CACHE_MAX_PER_PROJECT)
+        ).all()
+        if stale:
+            session.exec(delete(ReviewChunk).where(ReviewChunk.id.in_(stale)))
+            session.commit()
+
+def _load_chunks(project_id: int, keys: List[str]) -> dict:
+    # {chunk_key: result} of the stored chunks among keys, marked as used now
+    with Session(engine) as session:
+        rows = session.exec(select(ReviewChunk).where(
+            ReviewChunk.project_id == project_id, ReviewChunk.chunk_key.in_(set(keys))
+        )).all()
+        now = datetime.utcnow()
+        for r in rows:
+            r.last_used_at = now
+            session.add(r)
+        session.commit()
+        return {r.chunk_key: r.result for r in rows}
+
+def _store_chunk(project_id: int, kind: str, chunk_key: str, result: str):
+    with Session(engine) as session:
+        session.add(ReviewChunk(project_id=project_id, kind=kind, chunk_key=chunk_key, result=result))
+        try:
+            session.commit()
+        except IntegrityError:
+            # A concurrent review of the same text stored it first
+            session.rollback()
+
+def _save_review(project_id: int, kind: str, source: str, input_text: str, result: str) -> int:
+    title = input_text[:40] + "..." if len(input_text) > 40 else input_text
+    with Session(engine) as session:
+        review_obj = Review(
+            project_id=project_id,
+            kind=kind,
+            source=source,
+            title=title,
+            result=result,
+            input_size=len(input_text),
+            input_text=input_text
+        )
+        session.add(review_obj)
+        session.commit()
+        session.refresh(review_obj)
+        return review_obj.id
+
+# The review runs as a task on the event loop, so every database step goes through
+# asyncio.to_thread
+async def _review_chunks(job_id: str, project_id: int, kind: str, rules: str, input_text: str) -> str:
+    chunks = split_manuscript(input_text)
+    total = len(chunks)
+    keys = [_chunk_key(kind, rules, chunk) for chunk in chunks]
+    found = await asyncio.to_thread(_load_chunks, project_id, keys)
+
+    # Identical chunks (e.g. a repeated epigraph) are reviewed once
+    missing = list({k: i for i, k in reversed(list(enumerate(keys))) if k not in found}.values())
+    reused = sum(1 for k in keys if k in found)
+    progress = {"chunks_done": reused, "chunks_total": total, "reused": reused}
+    jobs.update(job_id, status="reviewing", progress=dict(progress))
+    semaphore = asyncio.Semaphore(REVIEW_MAX_CONCURRENCY)
+
+    async def review_chunk(idx: int):
+        async with semaphore:
+            part = await generate_text(create_review_chunk_prompt(rules, kind, chunks[idx]))
+        await asyncio.to_thread(_store_chunk, project_id, kind, keys[idx], part)
+        found[keys[idx]] = part
+        progress["chunks_done"] += keys.count(keys[idx])
+        jobs.update(job_id, progress=dict(progress))
+
+    outcomes = await asyncio.gather(*[review_chunk(i) for i in missing], return_exceptions=True)
+    errors = [o for o in outcomes if isinstance(o, Exception)]
+    if errors:
+        # Finished chunks are already stored and are reused by the retry
+        raise RuntimeError(f"{len(errors)} of {total} chunks failed, run the review again to resume: {errors[0]}")
+
+    jobs.update(job_id, status="synthesizing")
+    result = await generate_text(create_review_synthesis_prompt(rules, kind, [found[k] for k in keys]))
+    await asyncio.to_thread(_prune_chunks, project_id)
+    return result
+
+async def _run_review(job_id: str, project_id: int, kind: str, source: str, input_text: str):
+    try:
+        rules = await asyncio.to_thread(build_rules_preamble, project_id)
+        if len(input_text) <= REVIEW_SINGLE_MAX_CHARS:
+            jobs.update(job_id, status="reviewing")
+            prompt = create_general_review_prompt(rules, input_text) if kind == "general" else create_proofread_prompt(input_text)
+            result = await generate_text(prompt, cache=kind != "general")
+        else:
+            result = await _review_chunks(job_id, project_id, kind, rules, input_text)
+
+        review_id = await asyncio.to_thread(_save_review, project_id, kind, source, input_text, result)
+        jobs.update(job_id, status="done", result={"review_id": review_id, "result": result})
+    except Exception as e:
+        print(f"Review job {job_id} failed: {e}")
+        jobs.update(job_id, status="failed", error=str(e))
+
+def start_review(project_id: int, kind: str, source: str, input_text: str) -> str:
+    # Must be called from the event loop (i.e. an async route)
+    job_id = jobs.create("review", project_id=project_id, review_kind=kind)
+    task = asyncio.create_task(_run_review(job_id, project_id, kind, source, input_text))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return job_id
@@ -4,69 +4,152 @@ import uuid
 import json
 from typing import List, Optional
 from fastapi import APIRouter, Form, File, UploadFile
-from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlmodel import Session, select, delete
 import google.generativeai as genai
 
 from app.database import engine
-from app.models import Project, History, GeneralNotes, TempFile
-from app.services import get_text_model, build_rules_preamble
-from app.utils import (get_relevant_context_from_index, _clean_ai_division_output, _guess_ext,
-                       _safe_join_under, extract_text_from_file, create_vector_index)
+from app.models import Project, History, TempFile, LibraryFile, ProjectLibraryLink
+from app.services import generate_text, build_rules_preamble, stream_text, ndjson_text_stream
+from app.utils import _clean_ai_division_output, _guess_ext, _safe_join_under, save_upload_file, UploadTooLargeError
+from app.project_index import (NOTES_SOURCE, ensure_project_index, search_project_index, sync_source,
+                               library_source, temp_source)
+from app.ingestion import submit_temp_file, library_disk_path
+from app.pagination import PAGE_DEFAULT_LIMIT, keyset_page, parse_fields
+from app.prompt_budget import PromptSection, fit_to_budget, estimate_tokens
+from app.conversation_summary import history_for_prompt, schedule_summary_update, clear_summary
 from prompts import (create_prose_master_prompt, create_persona_prompt, create_chapter_breakdown_prompt,
                      create_synopsis_division_prompt, create_prose_division_prompt)
 
 router = APIRouter()
 TEMP_ROOT = "temp_files"
-VECTORSTORE_ROOT = "vectorstores"
+HISTORY_FIELDS = ("id", "project_id", "question", "answer", "created_at")
+# Caps inside PROMPT_TOKEN_BUDGET; past the budget, recent turns go first, then the
+# conversation summary, then files, then notes
+SECTION_TOKEN_CAPS = {
+    "files": int(os.environ.get("PROMPT_FILES_TOKENS", "6000")),
+    "notes": int(os.environ.get("PROMPT_NOTES_TOKENS", "6000")),
+    "summary": int(os.environ.get("PROMPT_SUMMARY_TOKENS", "2000")),
+    "history": int(os.environ.get("PROMPT_HISTORY_TOKENS", "6000")),
+}
+
+def _parse_ids(values: List[str]) -> List[str]:
+    # The client posts arrays through URLSearchParams, which joins them with commas
+    return [v.strip() for raw in values for v in str(raw).split(",") if v.strip()]
 
 @router.get("/chat/{project_id}")
-def get_chat(project_id: int):
+def get_chat(project_id: int, before_id: Optional[int] = None, limit: int = PAGE_DEFAULT_LIMIT, fields: str = ""):
     with Session(engine) as session:
-        rows = session.exec(select(History).where(History.project_id == project_id).order_by(History.created_at.desc())).all()
-    return JSONResponse({"items": [r.model_dump(mode='json') for r in rows]})
+        page = keyset_page(session, History, [History.project_id == project_id],
+                           parse_fields(fields, HISTORY_FIELDS, HISTORY_FIELDS), before_id, limit)
+    return JSONResponse(page)
 
 @router.post("/chat/{project_id}/clear")
 def clear_chat(project_id: int):
     with Session(engine) as session:
         session.exec(delete(History).where(History.project_id == project_id))
+        clear_summary(session, project_id)
         session.commit()
     return JSONResponse({"ok": True})
 
 @router.get("/history/{project_id}")
-def get_history(project_id: int):
+def get_history(project_id: int, before_id: Optional[int] = None, limit: int = PAGE_DEFAULT_LIMIT):
     with Session(engine) as session:
-        rows = session.exec(select(History.question).where(History.project_id == project_id).order_by(History.created_at.desc())).all()
-    return JSONResponse({"items": [r for r in rows]})
+        page = keyset_page(session, History, [History.project_id == project_id], ["id", "question"], before_id, limit)
+    return JSONResponse({"items": [r["question"] for r in page["items"]], "next_before_id": page["next_before_id"]})
 
 @router.post("/upload_temp_files/{project_id}")
 async def upload_temp_files(project_id: int, files: List[UploadFile] = File(...)):
+    os.makedirs(TEMP_ROOT, exist_ok=True)
     with Session(engine) as session:
-        file_ids = []; filenames = []
+        file_ids = []; filenames = []; job_ids = []; errors = []
         for uf in files:
             ext = _guess_ext(uf.filename)
             uid_filename = f"{uuid.uuid4().hex}{ext}"
             dest_full = _safe_join_under(TEMP_ROOT, uid_filename)
-            with open(dest_full, "wb") as f: f.write(await uf.read())
+            try:
+                _, content_hash = await save_upload_file(uf, dest_full)
+            except UploadTooLargeError as e:
+                errors.append({"filename": uf.filename, "error": str(e)})
+                continue
 
-            text_content = extract_text_from_file(dest_full)
-            if text_content:
-                index_dir = os.path.join(VECTORSTORE_ROOT, f"project_{project_id}", "temp")
-                os.makedirs(index_dir, exist_ok=True)
-                index_path = os.path.join(index_dir, uid_filename)
-                create_vector_index(text_content, index_path)
+            # Bytes already processed as a library file or an earlier temp file of this project
+            # reuse that file and index instead of being extracted and embedded again
+            reused = None
+            lf = session.exec(select(LibraryFile).where(
+                LibraryFile.content_hash == content_hash, LibraryFile.state == "done"
+            ).order_by(LibraryFile.id)).first()
+            if lf:
+                reused = (library_disk_path(lf.stored_path), lf.vector_index_path)
+            else:
+                tf = session.exec(select(TempFile).where(
+                    TempFile.project_id == project_id, TempFile.content_hash == content_hash, TempFile.state == "done"
+                ).order_by(TempFile.created_at)).first()
+                if tf:
+                    reused = (tf.stored_path, tf.vector_index_path)
 
-                rec = TempFile(project_id=project_id, original_filename=uf.filename, stored_path=dest_full, vector_index_path=index_path)
+            if reused:
+                os.remove(dest_full)
+                rec = TempFile(project_id=project_id, original_filename=uf.filename, stored_path=reused[0],
+                               vector_index_path=reused[1], state="done", content_hash=content_hash)
+                session.add(rec); session.commit(); session.refresh(rec)
+                await run_in_threadpool(sync_source, project_id, temp_source(rec.id), reused[1])
+            else:
+                rec = TempFile(project_id=project_id, original_filename=uf.filename, stored_path=dest_full,
+                               state="queued", content_hash=content_hash)
                 session.add(rec); session.commit(); session.refresh(rec)
-                file_ids.append(rec.id); filenames.append(uf.filename)
-    return JSONResponse({"ok": True, "file_ids": file_ids, "filenames": filenames})
+                job_ids.append(submit_temp_file(rec.id, uf.filename))
+            file_ids.append(rec.id); filenames.append(uf.filename)
+    status_code = 413 if errors and not file_ids else 200
+    return JSONResponse({"ok": bool(file_ids) or not errors, "file_ids": file_ids, "filenames": filenames,
+                         "job_ids": job_ids, "errors": errors}, status_code=status_code)
+
+def _get_project(project_id: int) -> Optional[Project]:
+    with Session(engine) as session:
+        return session.get(Project, project_id)
+
+def _question_sources(project_id: int, temp_ids: List[str], library_ids: List[int]):
+    # (source ids in the project index, display names, {source id: own index path} for
+    # attached library files that are not linked to the project)
+    source_ids = []; source_names = {}; unlinked_indexes = {}
+    with Session(engine) as session:
+        if temp_ids:
+            for tf in session.exec(select(TempFile).where(TempFile.project_id == project_id, TempFile.id.in_(temp_ids))).all():
+                source_ids.append(temp_source(tf.id))
+                source_names[temp_source(tf.id)] = tf.original_filename
+        if library_ids:
+            linked = set(session.exec(select(ProjectLibraryLink.file_id).where(ProjectLibraryLink.project_id == project_id)).all())
+            for lf in session.exec(select(LibraryFile).where(LibraryFile.id.in_(library_ids))).all():
+                source_names[library_source(lf.id)] = lf.filename
+                if lf.id in linked:
+                    source_ids.append(library_source(lf.id))
+                else:
+                    unlinked_indexes[library_source(lf.id)] = lf.vector_index_path
+    return source_ids, source_names, unlinked_indexes
+
+def _history_for_prompt(project_id: int):
+    with Session(engine) as session:
+        return history_for_prompt(session, project_id, SECTION_TOKEN_CAPS["history"])
+
+def _save_chapter_word_range(project_id: int, words_min: Optional[int], words_max: Optional[int]):
+    with Session(engine) as session:
+        project = session.get(Project, project_id)
+        if project:
+            project.words_per_chapter_min = words_min
+            project.words_per_chapter_max = words_max
+            session.add(project); session.commit()
+
+def _save_turn(project_id: int, question: str, answer: str):
+    with Session(engine) as session:
+        session.add(History(project_id=project_id, question=question, answer=answer)); session.commit()
 
 @router.post("/ask/{project_id}")
-def ask_project(
+async def ask_project(
     project_id: int, text: str = Form(""), use_notes: str = Form("1"),
     mode: str = Form(...), write_kind: str = Form(...), use_history: str = Form("1"),
     temperature: float = Form(0.7), persona: str = Form("partner"),
-    temp_file_ids: List[str] = Form([]), library_file_ids: List[int] = Form([]),
+    temp_file_ids: List[str] = Form([]), library_file_ids: List[str] = Form([]),
     synopsis_text_content: Optional[str] = Form(None),
     words_per_chapter_min: Optional[int] = Form(None),
     words_per_chapter_max: Optional[int] = Form(None),
@@ -76,84 +159,127 @@ def ask_project(
     current_draft: Optional[str] = Form(None),
     original_division: Optional[str] = Form(None),
     original_draft: Optional[str] = Form(None),
-    scene_description: Optional[str] = Form(None)
+    scene_description: Optional[str] = Form(None),
+    stream: str = Form("0")
 ):
-    with Session(engine) as session:
-        project = session.get(Project, project_id)
-        if not project:
-            return JSONResponse({"ok": False, "answer": "Project not found."}, status_code=404)
+    # Database work runs in the threadpool so it does not block the event loop
+    project = await run_in_threadpool(_get_project, project_id)
+    if not project:
+        return JSONResponse({"ok": False, "answer": "Project not found."}, status_code=404)
+
+    preamble = await run_in_threadpool(build_rules_preamble, project_id)
+
+    if project.kind == 'פרוזה':
+        preamble += create_prose_master_prompt() + "\n\n"
+
+    if mode == 'brainstorm' or mode == 'write':
+        preamble += create_persona_prompt(persona)
+
+    full_context = ""
+    is_discussion = False
+    sections = [PromptSection("preamble", preamble, required=True)]
+    
+    # Determine if it's a discussion-based call
+    if any([discussion_thread]):
+         is_discussion = True
+         thread_data = json.loads(discussion_thread)
+         thread_items = [f"{t['role']}: {t['content']}" for t in thread_data]
+         # Contextualize based on discussion type
+         if original_draft is not None and scene_description is not None:
+             full_context = f"**Original Scene Description (Context):**\n{scene_description}\n\n**Current Draft:**\n{original_draft}"
+         elif full_synopsis and chapter_content:
+             full_context = f"**Full Context:**\n{full_synopsis}\n\n**Original Content (Focus):**\n{chapter_content}"
+         elif current_draft is not None:
+             full_context = f"**Current Synopsis Draft:**\n{current_draft}"
+         elif original_division is not None:
+             full_context = f"**Original Divided Synopsis:**\n{original_division}"
+         # The thread is cut before the text under discussion, and from its oldest messages,
+         # since the newest ones are at the end
+         sections.append(PromptSection("discussion_context", full_context, priority=4))
+         sections.append(PromptSection("discussion", thread_items, priority=3, keep="tail"))
+    else:
+        # Regular call context building
+        source_ids, source_names, unlinked_indexes = await run_in_threadpool(
+            _question_sources, project_id, _parse_ids(temp_file_ids),
+            [int(i) for i in _parse_ids(library_file_ids) if i.isdigit()])
+        if use_notes == "1":
+            source_ids.insert(0, NOTES_SOURCE)
+
+        notes_hits = []; file_hits = []
+        if text.strip() and (source_ids or unlinked_indexes):
+            await run_in_threadpool(ensure_project_index, project_id)
+            hits = await run_in_threadpool(search_project_index, project_id, text, source_ids,
+                                           extra_indexes=unlinked_indexes)
+            notes_hits = [content for source, content in hits if source == NOTES_SOURCE]
+            file_hits = [f"[{source_names[source]}]\n{content}" for source, content in hits if source != NOTES_SOURCE]
+
+        history_summary, history_turns = "", []
+        if use_history == "1":
+            history_summary, history_turns = await run_in_threadpool(_history_for_prompt, project_id)
+
+        # Hits are ranked best first and turns oldest first, so cuts drop the weakest hits
+        # and the oldest turns; turns older than the summary are not sent at all
+        sections += [
+            PromptSection("files", file_hits, priority=3, max_tokens=SECTION_TOKEN_CAPS["files"], separator="\n---\n"),
+            PromptSection("notes", notes_hits, priority=4, max_tokens=SECTION_TOKEN_CAPS["notes"], separator="\n---\n"),
+            PromptSection("summary", history_summary, priority=2, max_tokens=SECTION_TOKEN_CAPS["summary"]),
+            PromptSection("history", history_turns, priority=1, max_tokens=SECTION_TOKEN_CAPS["history"], keep="tail"),
+        ]
 
-        preamble = build_rules_preamble(project_id)
+    prompt = ""
+    chapter_synopsis = ""
 
+    if write_kind == 'breakdown_chapter':
+        extractor_prompt = f"From the full synopsis, extract only the text for the chapter titled '{text}'.\n\nSYNOPSIS:\n{project.synopsis_text}"
+        chapter_synopsis = await generate_text(extractor_prompt, cache=True)
+        sections.append(PromptSection("request", chapter_synopsis, required=True))
+    elif write_kind == 'divide_synopsis':
+        if not synopsis_text_content or not synopsis_text_content.strip():
+            return JSONResponse({"ok": False, "answer": "Synopsis is empty."}, status_code=400)
+        sections.append(PromptSection("request", synopsis_text_content, required=True))
+    else:
+        sections.append(PromptSection("request", text, required=True))
+
+    fitted, token_report = fit_to_budget(sections)
+    if not is_discussion:
+        file_context = "להלן קטעים רלוונטיים מתוך הקבצים המצורפים:\n" + fitted["files"] + "\n\n" if fitted["files"] else ""
+        notes_context = "להלן קטעים רלוונטיים מתוך 'קובץ כללי':\n" + fitted["notes"] + "\n\n" if fitted["notes"] else ""
+        summary_context = "סיכום השיחה עד כה:\n" + fitted["summary"] + "\n\n" if fitted["summary"] else ""
+        history_context = "היסטוריית שיחה קודמת:\n" + fitted["history"] + "\n\n" if fitted["history"] else ""
+        full_context = f"{file_context}{notes_context}{summary_context}{history_context}"
+    else:
+        full_context = f"{fitted['discussion_context']}\n\n**Current Discussion:**\n{fitted['discussion']}" if fitted["discussion_context"] \
+            else f"**Current Discussion:**\n{fitted['discussion']}"
+
+    if write_kind == 'breakdown_chapter':
+        prompt = create_chapter_breakdown_prompt(preamble, full_context, chapter_synopsis, project)
+
+    elif write_kind == 'divide_synopsis':
         if project.kind == 'פרוזה':
-            preamble += create_prose_master_prompt() + "\n\n"
-
-        if mode == 'brainstorm' or mode == 'write':
-            preamble += create_persona_prompt(persona)
-
-        full_context = ""
-        is_discussion = False
-        
-        # Determine if it's a discussion-based call
-        if any([discussion_thread]):
-             is_discussion = True
-             thread_data = json.loads(discussion_thread)
-             thread_str = "\n".join([f"{t['role']}: {t['content']}" for t in thread_data])
-             # Contextualize based on discussion type
-             if original_draft is not None and scene_description is not None:
-                 full_context = f"**Original Scene Description (Context):**\n{scene_description}\n\n**Current Draft:**\n{original_draft}\n\n**Current Discussion:**\n{thread_str}"
-             elif full_synopsis and chapter_content:
-                 full_context = f"**Full Context:**\n{full_synopsis}\n\n**Original Content (Focus):**\n{chapter_content}\n\n**Current Discussion:**\n{thread_str}"
-             elif current_draft is not None:
-                 full_context = f"**Current Synopsis Draft:**\n{current_draft}\n\n**Current Discussion:**\n{thread_str}"
-             elif original_division is not None:
-                 full_context = f"**Original Divided Synopsis:**\n{original_division}\n\n**Current Discussion:**\n{thread_str}"
+            await run_in_threadpool(_save_chapter_word_range, project_id, words_per_chapter_min, words_per_chapter_max)
+            prompt = create_prose_division_prompt(synopsis_text=synopsis_text_content, min_words=words_per_chapter_min or 1500, max_words=words_per_chapter_max or 3000, preamble=preamble, context=full_context)
         else:
-            # Regular call context building
-            notes_context = ""
-            if use_notes == "1" and text.strip():
-                gn_obj = session.exec(select(GeneralNotes).where(GeneralNotes.project_id == project_id)).first()
-                if gn_obj and gn_obj.vector_index_path:
-                    notes_context = get_relevant_context_from_index(text, gn_obj.vector_index_path)
-                    if notes_context: notes_context = "להלן קטעים רלוונטיים מתוך 'קובץ כללי':\n" + notes_context + "\n\n"
-
-            chat_history_str = ""
-            if use_history == "1":
-                turns = session.exec(select(History).where(History.project_id == project_id).order_by(History.created_at.desc()).limit(10)).all()
-                chat_history_str = "\n".join([f"ש: {t.question}\nת: {t.answer}" for t in reversed(turns)])
-
-            file_context = "" # Placeholder for file context logic
-            history_context = "היסטוריית שיחה קודמת:\n" + chat_history_str + "\n\n" if chat_history_str else ""
-            full_context = f"{file_context}{notes_context}{history_context}"
-
-        prompt = ""
-        text_model = get_text_model()
-
-        if write_kind == 'breakdown_chapter':
-            extractor_prompt = f"From the full synopsis, extract only the text for the chapter titled '{text}'.\n\nSYNOPSIS:\n{project.synopsis_text}"
-            chapter_synopsis = text_model.generate_content(extractor_prompt).text
-            prompt = create_chapter_breakdown_prompt(preamble, full_context, chapter_synopsis, project)
-
-        elif write_kind == 'divide_synopsis':
-            if not synopsis_text_content or not synopsis_text_content.strip():
-                return JSONResponse({"ok": False, "answer": "Synopsis is empty."}, status_code=400)
-            if project.kind == 'פרוזה':
-                project.words_per_chapter_min = words_per_chapter_min
-                project.words_per_chapter_max = words_per_chapter_max
-                session.add(project); session.commit()
-                prompt = create_prose_division_prompt(synopsis_text=synopsis_text_content, min_words=words_per_chapter_min or 1500, max_words=words_per_chapter_max or 3000, preamble=preamble, context=full_context)
-            else:
-                prompt = create_synopsis_division_prompt(synopsis_text=synopsis_text_content, num_chapters=project.chapters or 18, preamble=preamble, context=full_context)
-        else:
-            prompt = f"{preamble}{full_context}\n\nבהתבסס על כל ההקשר שסופק, ענה על הבקשה הבאה: {text}"
+            prompt = create_synopsis_division_prompt(synopsis_text=synopsis_text_content, num_chapters=project.chapters or 18, preamble=preamble, context=full_context)
+    else:
+        prompt = f"{preamble}{full_context}\n\nבהתבסס על כל ההקשר שסופק, ענה על הבקשה הבאה: {text}"
+    token_report["prompt_total"] = estimate_tokens(prompt)
+
+    config = genai.types.GenerationConfig(temperature=float(temperature))
+    save_turn = not is_discussion and write_kind not in ['breakdown_chapter', 'divide_synopsis']
+    tag = f"【{mode}:{write_kind}】" if mode == 'write' else f"【{mode}】"
+
+    async def finalize(raw_answer: str) -> str:
+        answer = _clean_ai_division_output(raw_answer) if write_kind == 'divide_synopsis' else raw_answer
+        if save_turn:
+            await run_in_threadpool(_save_turn, project_id, f"{tag} {text}", answer)
+            schedule_summary_update(project_id)
+        return answer
 
-        config = genai.types.GenerationConfig(temperature=float(temperature))
-        resp = text_model.generate_content(contents=[prompt], generation_config=config)
-        answer = _clean_ai_division_output(resp.text) if write_kind == 'divide_synopsis' else resp.text
+    if stream == "1":
+        return StreamingResponse(ndjson_text_stream(stream_text(prompt, config), finalize, meta={"tokens": token_report}),
+                                 media_type="application/x-ndjson")
 
-        if not is_discussion and write_kind not in ['breakdown_chapter', 'divide_synopsis']:
-            tag = f"【{mode}:{write_kind}】" if mode == 'write' else f"【{mode}】"
-            session.add(History(project_id=project_id, question=f"{tag} {text}", answer=answer)); session.commit()
+    answer = await finalize(await generate_text(prompt, config))
 
-        # Cleanup temp files logic can be added here
-        return JSONResponse({"ok": True, "answer": answer})
+    # Cleanup temp files logic can be added here
+    return JSONResponse({"ok": True, "answer": answer, "meta": {"tokens": token_report}})
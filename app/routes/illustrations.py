@@ -1,51 +1,36 @@
 # app/routes/illustrations.py
 import os
-import re
-import uuid
+import json
 from typing import Optional
 from fastapi import APIRouter, Form
 from fastapi.responses import JSONResponse
 from sqlmodel import Session, select
-from PIL import Image
 
 from app.database import engine
-from app.models import ProjectObject, Illustration
-from app.services import (rewrite_prompt_for_image_generation, generate_image_with_gemini, get_text_model)
+from app.models import ProjectObject, Illustration, ChapterOutline
+from app.image_jobs import MEDIA_ROOT, ImageQueueFullError, submit_illustration, submit_object
+from app.media import variant_urls, remove_derivatives
+from app.storyboard import STORYBOARD_MAX_FRAMES, split_outline_frames, start_storyboard
 from app.utils import _safe_join_under
+from app.pagination import PAGE_DEFAULT_LIMIT, keyset_page, parse_fields
 
 router = APIRouter()
-MEDIA_ROOT = "media"
+ILLUSTRATION_FIELDS = ("id", "project_id", "file_path", "prompt", "style", "scene_label", "created_at",
+                       "source_illustration_id")
 
 @router.get("/project/{project_id}/objects/list")
 def list_objects(project_id: int):
     with Session(engine) as session:
         objects = session.exec(select(ProjectObject).where(ProjectObject.project_id == project_id).order_by(ProjectObject.created_at.desc())).all()
-        return JSONResponse({"items": [o.model_dump(mode='json') for o in objects]})
+        return JSONResponse({"items": [{**o.model_dump(mode='json'), **variant_urls(o.reference_image_path)} for o in objects]})
 
 @router.post("/project/{project_id}/objects/create")
-def create_object(project_id: int, name: str = Form(...), description: str = Form(...), style: str = Form("")):
-    style_prefix = f"Style: {style}. " if style else ""
-    raw_prompt = f"{style_prefix}A single character reference image named '{name}'. {description}. Centered, plain white background, full body shot."
+async def create_object(project_id: int, name: str = Form(...), description: str = Form(...), style: str = Form("")):
     try:
-        safe_prompt = rewrite_prompt_for_image_generation(raw_prompt)
-        img_bytes = generate_image_with_gemini(safe_prompt)
-        
-        project_dir = os.path.join(MEDIA_ROOT, f"project_{project_id}_objects")
-        os.makedirs(project_dir, exist_ok=True)
-        filename = f"obj_{uuid.uuid4().hex}.png"
-        path = os.path.join(project_dir, filename)
-        
-        with open(path, "wb") as f:
-            f.write(img_bytes)
-            
-        rel_url = f"/media/project_{project_id}_objects/{filename}"
-        with Session(engine) as session:
-            obj = ProjectObject(project_id=project_id, name=name, description=description, style=style, reference_image_path=rel_url)
-            session.add(obj)
-            session.commit()
-        return JSONResponse({"ok": True})
-    except Exception as e:
-        return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
+        job_id = submit_object(project_id, name, description, style)
+    except ImageQueueFullError as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=503)
+    return JSONResponse({"ok": True, "job_id": job_id})
 
 @router.post("/project/{project_id}/objects/delete")
 def delete_object(project_id: int, object_id: int = Form(...)):
@@ -57,6 +42,7 @@ def delete_object(project_id: int, object_id: int = Form(...)):
                     full_path = _safe_join_under(MEDIA_ROOT, obj.reference_image_path.replace("/media/", ""))
                     if os.path.exists(full_path):
                         os.remove(full_path)
+                    remove_derivatives(full_path)
                 except Exception as e:
                     print(f"Could not delete object file: {e}")
             session.delete(obj)
@@ -65,55 +51,55 @@ def delete_object(project_id: int, object_id: int = Form(...)):
     return JSONResponse({"ok": False, "error": "Object not found"}, status_code=404)
 
 @router.post("/image/{project_id}")
-def create_image(project_id: int, desc: str = Form(...), style: str = Form(""), scene_label: str = Form(""), source_image_id: Optional[int] = Form(None)):
-    with Session(engine) as session:
+async def create_image(project_id: int, desc: str = Form(...), style: str = Form(""), scene_label: str = Form(""), source_image_id: Optional[int] = Form(None)):
+    try:
+        job_id = submit_illustration(project_id, desc, style, scene_label, source_image_id)
+    except ImageQueueFullError as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=503)
+    return JSONResponse({"ok": True, "job_id": job_id})
+
+@router.post("/storyboard/{project_id}")
+async def create_storyboard(project_id: int, chapter_title: str = Form(""), scenes: str = Form(""), style: str = Form("")):
+    # scenes is a JSON list of {"label", "description"}; without it the frames are read
+    # from the chapter's saved outline
+    if scenes.strip():
         try:
-            source_image_pil = None
-            if source_image_id:
-                source_ill = session.get(Illustration, source_image_id)
-                if source_ill and source_ill.file_path:
-                    full_path = _safe_join_under(MEDIA_ROOT, source_ill.file_path.replace("/media/", ""))
-                    if os.path.exists(full_path):
-                        source_image_pil = Image.open(full_path)
-
-            all_objects = session.exec(select(ProjectObject).where(ProjectObject.project_id == project_id)).all()
-            consistency_notes = [f"- '{obj.name}': {obj.description}" for obj in all_objects if re.search(r'\b' + re.escape(obj.name) + r'\b', desc, re.IGNORECASE)]
-
-            text_model = get_text_model()
-            english_desc = text_model.generate_content(f"Translate to a simple, clear English sentence for an AI: '{desc}'").text.strip()
-
-            style_prefix = f"In the style of {style}: " if style else ""
-            raw_prompt_text = f"{style_prefix}A full scene. Description: {english_desc}"
-            if consistency_notes:
-                raw_prompt_text += "\n\n**Consistency Guidelines:**\n" + "\n".join(consistency_notes)
-
-            final_prompt = rewrite_prompt_for_image_generation(raw_prompt_text)
-            img_bytes = generate_image_with_gemini(final_prompt, source_image=source_image_pil)
-
-            project_dir = os.path.join(MEDIA_ROOT, f"project_{project_id}")
-            os.makedirs(project_dir, exist_ok=True)
-            filename = f"img_{uuid.uuid4().hex}.png"
-            path = os.path.join(project_dir, filename)
-            with open(path, "wb") as f:
-                f.write(img_bytes)
-            rel_url = f"/media/project_{project_id}/{filename}"
-
-            ill = Illustration(project_id=project_id, file_path=rel_url, prompt=desc, style=style, scene_label=scene_label, source_illustration_id=source_image_id)
-            session.add(ill)
-            session.commit()
-
-            return JSONResponse({"ok": True, "url": rel_url})
-
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
+            frames = [{"label": str(sc.get("label") or f"סצנה {i}"), "description": str(sc.get("description") or "").strip()}
+                      for i, sc in enumerate(json.loads(scenes), 1)]
+        except (ValueError, TypeError, AttributeError):
+            return JSONResponse({"ok": False, "error": "scenes must be a JSON list of {label, description}"}, status_code=400)
+        frames = [f for f in frames if f["description"]]
+    elif chapter_title:
+        with Session(engine) as session:
+            outline = session.exec(select(ChapterOutline).where(
+                ChapterOutline.project_id == project_id,
+                ChapterOutline.chapter_title == chapter_title
+            )).first()
+            if not outline:
+                return JSONResponse({"ok": False, "error": "Outline not found"}, status_code=404)
+            frames = split_outline_frames(outline.outline_text)
+    else:
+        return JSONResponse({"ok": False, "error": "chapter_title or scenes is required"}, status_code=400)
+
+    if not frames:
+        return JSONResponse({"ok": False, "error": "No frames found"}, status_code=400)
+    if len(frames) > STORYBOARD_MAX_FRAMES:
+        return JSONResponse({"ok": False, "error": f"Too many frames ({len(frames)}), the limit is {STORYBOARD_MAX_FRAMES}"}, status_code=400)
+    try:
+        job_id = start_storyboard(project_id, frames, style, chapter_title, chapter_title or None)
+    except ImageQueueFullError as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=503)
+    return JSONResponse({"ok": True, "job_id": job_id, "frames": [f["label"] for f in frames]})
 
 @router.get("/images/{project_id}")
-def list_images(project_id: int):
+def list_images(project_id: int, before_id: Optional[int] = None, limit: int = PAGE_DEFAULT_LIMIT, fields: str = ""):
     with Session(engine) as session:
-        rows = session.exec(select(Illustration).where(Illustration.project_id == project_id).order_by(Illustration.created_at.desc())).all()
-    return JSONResponse({"items": [r.model_dump(mode='json') for r in rows]})
+        page = keyset_page(session, Illustration, [Illustration.project_id == project_id],
+                           parse_fields(fields, ILLUSTRATION_FIELDS, ILLUSTRATION_FIELDS), before_id, limit)
+    for item in page["items"]:
+        if "file_path" in item:
+            item.update(variant_urls(item["file_path"]))
+    return JSONResponse(page)
 
 @router.post("/images/{pid}/delete")
 def delete_image(pid: int, id: int = Form(...)):
@@ -124,6 +110,7 @@ def delete_image(pid: int, id: int = Form(...)):
                 full_path = _safe_join_under(MEDIA_ROOT, row.file_path.replace("/media/", ""))
                 if os.path.exists(full_path):
                     os.remove(full_path)
+                remove_derivatives(full_path)
             except Exception as e:
                 print(f"Could not delete file {row.file_path}: {e}")
             session.delete(row)
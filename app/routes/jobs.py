@@ -0,0 +1,32 @@
+# app/routes/jobs.py
+import os
+import time
+import asyncio
+from typing import Optional
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.jobs import jobs, FINISHED_STATES
+
+router = APIRouter(prefix="/api/jobs")
+JOB_MAX_WAIT_SECONDS = float(os.environ.get("JOB_MAX_WAIT_SECONDS", "25"))
+JOB_WAIT_POLL_SECONDS = 0.25
+
+@router.get("")
+def list_jobs(kind: str, project_id: Optional[int] = None):
+    meta = {"project_id": project_id} if project_id is not None else {}
+    return JSONResponse({"ok": True, "items": jobs.list_active(kind, **meta)})
+
+@router.get("/{job_id}")
+async def job_status(job_id: str, since: str = "", wait: float = 0):
+    # Long poll: given the updated_at the client already has, answer once the job changes
+    # or after wait seconds, whichever comes first
+    deadline = time.monotonic() + min(max(wait, 0), JOB_MAX_WAIT_SECONDS)
+    job = jobs.get(job_id)
+    while job and since and job["updated_at"] == since and job["status"] not in FINISHED_STATES \
+            and time.monotonic() < deadline:
+        await asyncio.sleep(JOB_WAIT_POLL_SECONDS)
+        job = jobs.get(job_id)
+    if not job:
+        return JSONResponse({"ok": False, "error": "Job not found"}, status_code=404)
+    return JSONResponse({"ok": True, "job": job})
@@ -1,23 +1,27 @@
 # app/routes/library.py
 import os
 import uuid
-import shutil
-from typing import List
+from typing import List, Optional
 from fastapi import APIRouter, Form, File, UploadFile
 from fastapi.responses import JSONResponse
 from sqlmodel import Session, select
 
 from app.database import engine
 from app.models import LibraryFile, ProjectLibraryLink
-from app.utils import _guess_ext, _safe_join_under, extract_text_from_file, create_vector_index
+from app.utils import _guess_ext, _safe_join_under, save_upload_file, UploadTooLargeError
+from app.project_index import sync_source, remove_source, library_source
+from app.ingestion import submit_library_file, library_job_for, library_disk_path, release_assets, PENDING_STATES
+from app.extraction import get_extracted, split_units
+from app.pagination import PAGE_DEFAULT_LIMIT, keyset_page, parse_fields
 
 router = APIRouter(prefix="/api/library")
 LIBRARY_ROOT = "library"
-VECTORSTORE_ROOT = "vectorstores"
 ALLOWED_EXTS = {".pdf", ".docx", ".txt", ".png", ".jpg", ".jpeg", ".webp"}
+LIBRARY_FIELDS = ("id", "filename", "stored_path", "ext", "size", "state", "uploaded_at")
 
 @router.post("/upload")
 async def library_upload(files: List[UploadFile] = File(...)):
+    uploaded = []; errors = []
     with Session(engine) as session:
         for uf in files:
             ext = _guess_ext(uf.filename)
@@ -27,46 +31,105 @@ async def library_upload(files: List[UploadFile] = File(...)):
             dest_full = _safe_join_under(LIBRARY_ROOT, uid_filename)
             
             try:
-                with open(dest_full, "wb") as f:
-                    f.write(await uf.read())
-                
-                stored_url_path = f"/library/{uid_filename}"
-                text_content = extract_text_from_file(dest_full)
-                index_path = None
-                
-                if text_content.strip():
-                    index_dir = os.path.join(VECTORSTORE_ROOT, "library")
-                    os.makedirs(index_dir, exist_ok=True)
-                    index_name = uid_filename.replace('.', '_')
-                    index_path = os.path.join(index_dir, index_name)
-                    create_vector_index(text_content, index_path)
+                size, content_hash = await save_upload_file(uf, dest_full)
 
-                rec = LibraryFile(
-                    filename=uf.filename, 
-                    stored_path=stored_url_path, 
-                    ext=ext, 
-                    size=uf.size, 
-                    vector_index_path=index_path
-                )
+                # Identical bytes reuse the stored file and vector index of an earlier upload
+                original = session.exec(select(LibraryFile).where(
+                    LibraryFile.content_hash == content_hash, LibraryFile.state != "failed"
+                ).order_by(LibraryFile.id)).first()
+                if original:
+                    os.remove(dest_full)
+                    rec = LibraryFile(
+                        filename=uf.filename,
+                        stored_path=original.stored_path,
+                        ext=ext,
+                        size=size,
+                        state=original.state,
+                        vector_index_path=original.vector_index_path,
+                        content_hash=content_hash
+                    )
+                else:
+                    rec = LibraryFile(
+                        filename=uf.filename, 
+                        stored_path=f"/library/{uid_filename}", 
+                        ext=ext, 
+                        size=size, 
+                        state="queued",
+                        content_hash=content_hash
+                    )
                 session.add(rec)
                 session.commit()
+                session.refresh(rec)
+                job_id = None
+                if original and rec.state != "done":
+                    # Re-read now that this row is committed: if the original is still pending,
+                    # its ingestion will finish this row along with it
+                    session.refresh(original)
+                    if original.state in PENDING_STATES:
+                        job_id = library_job_for(content_hash)
+                    else:
+                        rec.state, rec.vector_index_path = original.state, original.vector_index_path
+                        session.add(rec); session.commit(); session.refresh(rec)
+                elif not original:
+                    job_id = submit_library_file(rec.id, uf.filename)
+                uploaded.append({"id": rec.id, "filename": uf.filename, "job_id": job_id, "duplicate": bool(original)})
+            except UploadTooLargeError as e:
+                errors.append({"filename": uf.filename, "error": str(e)})
             except Exception as e:
                 print(f"Failed to save file {uf.filename}: {e}")
-    return JSONResponse({"ok": True})
+                errors.append({"filename": uf.filename, "error": str(e)})
+    status_code = 413 if errors and not uploaded else 200
+    return JSONResponse({"ok": bool(uploaded) or not errors, "files": uploaded, "job_ids": [u["job_id"] for u in uploaded if u["job_id"]],
+                         "errors": errors}, status_code=status_code)
 
 @router.get("/list")
-def library_list():
+def library_list(before_id: Optional[int] = None, limit: int = PAGE_DEFAULT_LIMIT, fields: str = ""):
+    selected = parse_fields(fields.replace("url", "stored_path"), LIBRARY_FIELDS, LIBRARY_FIELDS)
+    with Session(engine) as session:
+        page = keyset_page(session, LibraryFile, [], selected, before_id, limit, order_field="uploaded_at")
+    for item in page["items"]:
+        if "stored_path" in item:
+            item["url"] = item.pop("stored_path")
+    return JSONResponse(page)
+
+@router.get("/preview/{file_id}")
+def library_preview(file_id: int, start: int = 0, count: int = 3):
+    # Pages (PDF/TXT) or paragraphs (DOCX) from the extracted-text sidecar
+    with Session(engine) as session:
+        r = session.get(LibraryFile, file_id)
+        if not r:
+            return JSONResponse({"ok": False, "error": "File not found"}, status_code=404)
+        full_path, content_hash = library_disk_path(r.stored_path), r.content_hash
+    try:
+        extracted = get_extracted(full_path, content_hash) if content_hash else None
+    except Exception as e:
+        print(f"Could not extract preview for library file {file_id}: {e}")
+        extracted = None
+    if extracted is None:
+        return JSONResponse({"ok": False, "error": "No extracted text for this file"}, status_code=404)
+    units = split_units(extracted)
+    start = max(0, start)
+    count = max(0, min(count, 50))
+    pages = [{"index": i, "offset": extracted["offsets"][i], "text": units[i]}
+             for i in range(start, min(start + count, len(units)))]
+    return JSONResponse({"ok": True, "unit": extracted["unit"], "total": len(units), "pages": pages})
+
+@router.post("/reindex")
+def library_reindex():
+    # Rebuilds every library index from the extracted-text sidecars and the embedding cache,
+    # e.g. after a change of chunk size; one job per distinct file
+    job_ids = []
     with Session(engine) as session:
-        rows = session.exec(select(LibraryFile).order_by(LibraryFile.uploaded_at.desc())).all()
-    items = [{
-        "id": r.id, 
-        "filename": r.filename, 
-        "url": r.stored_path, 
-        "ext": r.ext, 
-        "size": r.size, 
-        "uploaded_at": r.uploaded_at.isoformat()
-    } for r in rows]
-    return JSONResponse({"items": items})
+        rows = session.exec(select(LibraryFile).where(LibraryFile.state.in_(("done", "failed"))).order_by(LibraryFile.id)).all()
+        owners = {}
+        for r in rows:
+            owners.setdefault(r.content_hash or f"row:{r.id}", (r.id, r.filename))
+            r.state = "queued"
+            session.add(r)
+        session.commit()
+    for file_id, filename in owners.values():
+        job_ids.append(submit_library_file(file_id, filename))
+    return JSONResponse({"ok": True, "job_ids": job_ids})
 
 @router.post("/delete")
 def library_delete(id: int = Form(...)):
@@ -75,22 +138,23 @@ def library_delete(id: int = Form(...)):
         if not r: 
             return JSONResponse({"ok": False}, status_code=404)
         
-        try:
-            filename = r.stored_path.replace("/library/", "", 1)
-            full_path = _safe_join_under(LIBRARY_ROOT, filename)
-            if os.path.exists(full_path): 
-                os.remove(full_path)
-            if r.vector_index_path and os.path.exists(r.vector_index_path):
-                shutil.rmtree(r.vector_index_path)
-        except Exception as e:
-            print(f"Could not delete file assets: {e}")
-            
+        full_path = library_disk_path(r.stored_path)
+        index_path, content_hash = r.vector_index_path, r.content_hash
+
         links = session.exec(select(ProjectLibraryLink).where(ProjectLibraryLink.file_id == r.id)).all()
+        linked_projects = [l.project_id for l in links]
         for l in links: 
             session.delete(l)
             
         session.delete(r)
         session.commit()
+    try:
+        # Other rows uploaded with the same bytes may still be using the file and index
+        release_assets(full_path, index_path, content_hash)
+    except Exception as e:
+        print(f"Could not delete file assets: {e}")
+    for pid in linked_projects:
+        remove_source(pid, library_source(id))
     return JSONResponse({"ok": True})
 
 @router.get("/linked/{project_id}")
@@ -108,6 +172,9 @@ def library_link(project_id: int = Form(...), file_id: int = Form(...)):
         if not exists:
             session.add(ProjectLibraryLink(project_id=project_id, file_id=file_id))
             session.commit()
+        lf = session.get(LibraryFile, file_id)
+        file_index_path = lf.vector_index_path if lf else None
+    sync_source(project_id, library_source(file_id), file_index_path)
     return JSONResponse({"ok": True})
 
 @router.post("/unlink")
@@ -119,4 +186,5 @@ def library_unlink(project_id: int = Form(...), file_id: int = Form(...)):
         if link:
             session.delete(link)
             session.commit()
+    remove_source(project_id, library_source(file_id))
     return JSONResponse({"ok": True})
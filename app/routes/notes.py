@@ -1,13 +1,13 @@
 # app/routes/notes.py
 import os
-import shutil
 from fastapi import APIRouter, Form
 from fastapi.responses import JSONResponse
 from sqlmodel import Session, select
 
 from app.database import engine
 from app.models import GeneralNotes
-from app.utils import create_vector_index
+from app.utils import update_vector_index, remove_vector_index
+from app.project_index import sync_source, NOTES_SOURCE
 
 router = APIRouter()
 VECTORSTORE_ROOT = "vectorstores"
@@ -31,15 +31,15 @@ def save_general(project_id: int, text: str = Form("")):
         os.makedirs(index_dir, exist_ok=True)
         index_path = os.path.join(index_dir, "general_notes_index")
 
-        if os.path.exists(index_path):
-            shutil.rmtree(index_path)
-
         if text.strip():
-            create_vector_index(text, index_path)
+            update_vector_index(text, index_path)
             gn.vector_index_path = index_path
         else:
+            remove_vector_index(index_path)
             gn.vector_index_path = None
         
+        notes_index_path = gn.vector_index_path
         session.add(gn)
         session.commit()
+    sync_source(project_id, NOTES_SOURCE, notes_index_path)
     return JSONResponse({"ok": True})
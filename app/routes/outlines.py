@@ -1,12 +1,13 @@
 # app/routes/outlines.py
 import json
 from fastapi import APIRouter, Form
-from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlmodel import Session, select
 
 from app.database import engine
 from app.models import ChapterOutline, Project
-from app.services import get_text_model, build_rules_preamble
+from app.services import generate_text, build_rules_preamble, stream_text, ndjson_text_stream
 from prompts import (create_scene_update_prompt, create_scene_draft_prompt, 
                      create_draft_update_prompt, create_prose_master_prompt)
 
@@ -50,34 +51,36 @@ def get_outline(project_id: int, chapter_title: str):
     return JSONResponse({"ok": False, "error": "Outline not found"}, status_code=404)
 
 @router.post("/update_scene_from_discussion")
-def update_scene_from_discussion(project_id: int, original_content: str = Form(...), discussion_thread: str = Form(...), chapter_outline: str = Form(...)):
+async def update_scene_from_discussion(project_id: int, original_content: str = Form(...), discussion_thread: str = Form(...), chapter_outline: str = Form(...)):
     try:
         thread_data = json.loads(discussion_thread)
         thread_str = "\n".join([f"{t['role']}: {t['content']}" for t in thread_data])
         prompt = create_scene_update_prompt(original_content, thread_str, chapter_outline)
-        response = get_text_model().generate_content(prompt)
-        return JSONResponse({"ok": True, "updated_content": response.text})
+        updated_content = await generate_text(prompt)
+        return JSONResponse({"ok": True, "updated_content": updated_content})
     except Exception as e:
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
 
 @router.post("/write_scene")
-def write_scene(project_id: int, scene_title: str = Form(...), scene_description: str = Form(...)):
+async def write_scene(project_id: int, scene_title: str = Form(...), scene_description: str = Form(...), stream: str = Form("0")):
     try:
-        preamble = build_rules_preamble(project_id)
+        preamble = await run_in_threadpool(build_rules_preamble, project_id)
         context = preamble + create_prose_master_prompt()
         prompt = create_scene_draft_prompt(scene_title, scene_description, context)
-        response = get_text_model().generate_content(prompt)
-        return JSONResponse({"ok": True, "scene_draft": response.text})
+        if stream == "1":
+            return StreamingResponse(ndjson_text_stream(stream_text(prompt)), media_type="application/x-ndjson")
+        scene_draft = await generate_text(prompt)
+        return JSONResponse({"ok": True, "scene_draft": scene_draft})
     except Exception as e:
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
 
 @router.post("/update_draft_from_discussion")
-def update_draft_from_discussion(project_id: int, original_draft: str = Form(...), discussion_thread: str = Form(...), scene_description: str = Form(...)):
+async def update_draft_from_discussion(project_id: int, original_draft: str = Form(...), discussion_thread: str = Form(...), scene_description: str = Form(...)):
     try:
         thread_data = json.loads(discussion_thread)
         thread_str = "\n".join([f"{t['role']}: {t['content']}" for t in thread_data])
         prompt = create_draft_update_prompt(original_draft, thread_str, scene_description)
-        response = get_text_model().generate_content(prompt)
-        return JSONResponse({"ok": True, "updated_draft": response.text})
+        updated_draft = await generate_text(prompt)
+        return JSONResponse({"ok": True, "updated_draft": updated_draft})
     except Exception as e:
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
@@ -9,7 +9,9 @@ from sqlmodel import Session, select, delete
 
 from app.database import engine
 from app.models import (Project, ChapterOutline, SynopsisHistory, History, GeneralNotes, Rule, 
-                        Illustration, ReviewDiscussion, Review, ProjectLibraryLink, ProjectObject)
+                        Illustration, ReviewDiscussion, Review, ProjectLibraryLink, ProjectObject, TempFile, ReviewChunk,
+                        ConversationSummary)
+from app.ingestion import release_assets
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
@@ -57,13 +59,17 @@ def delete_project_route(project_id: int):
         session.exec(delete(ChapterOutline).where(ChapterOutline.project_id == project_id))
         session.exec(delete(SynopsisHistory).where(SynopsisHistory.project_id == project_id))
         session.exec(delete(History).where(History.project_id == project_id))
+        session.exec(delete(ConversationSummary).where(ConversationSummary.project_id == project_id))
         session.exec(delete(GeneralNotes).where(GeneralNotes.project_id == project_id))
         session.exec(delete(Rule).where(Rule.project_id == project_id))
         session.exec(delete(Illustration).where(Illustration.project_id == project_id))
         session.exec(delete(ReviewDiscussion).where(ReviewDiscussion.project_id == project_id))
         session.exec(delete(Review).where(Review.project_id == project_id))
+        session.exec(delete(ReviewChunk).where(ReviewChunk.project_id == project_id))
         session.exec(delete(ProjectLibraryLink).where(ProjectLibraryLink.project_id == project_id))
         session.exec(delete(ProjectObject).where(ProjectObject.project_id == project_id))
+        temp_assets = set(session.exec(select(TempFile.stored_path, TempFile.vector_index_path, TempFile.content_hash).where(TempFile.project_id == project_id)).all())
+        session.exec(delete(TempFile).where(TempFile.project_id == project_id))
         project = session.get(Project, project_id)
         if project:
             session.delete(project)
@@ -72,6 +78,9 @@ def delete_project_route(project_id: int):
         shutil.rmtree(os.path.join(MEDIA_ROOT, f"project_{project_id}_objects"), ignore_errors=True)
         shutil.rmtree(os.path.join(MEDIA_ROOT, f"project_{project_id}"), ignore_errors=True)
         shutil.rmtree(os.path.join(VECTORSTORE_ROOT, f"project_{project_id}"), ignore_errors=True)
+        # Temp files may be reusing library assets, which stay while a library row needs them
+        for stored_path, index_path, content_hash in temp_assets:
+            release_assets(stored_path, index_path, content_hash)
     except Exception as e:
         print(f"Could not clean up asset directories for project {project_id}: {e}")
     return RedirectResponse("/", status_code=303)
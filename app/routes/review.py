@@ -1,49 +1,45 @@
 # app/routes/review.py
+from typing import Optional
 from fastapi import APIRouter, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from sqlmodel import Session, select, delete
 
 from app.database import engine
 from app.models import Review, ReviewDiscussion
-from app.services import get_text_model, build_rules_preamble
-from prompts import (create_general_review_prompt, create_proofread_prompt, 
-                     create_review_discussion_prompt, create_review_update_prompt)
+from app.services import generate_text
+from app.pagination import PAGE_DEFAULT_LIMIT, keyset_page, parse_fields
+from app.review_pipeline import start_review
+from prompts import create_review_discussion_prompt, create_review_update_prompt
 
 router = APIRouter()
+REVIEW_FIELDS = ("id", "project_id", "kind", "source", "title", "input_size", "input_text", "result", "created_at")
+# input_text and result can each be a whole manuscript, so lists leave them out by default
+REVIEW_LIST_FIELDS = ("id", "project_id", "kind", "source", "title", "input_size", "created_at")
 
 @router.post("/review/{project_id}/run")
-def run_review(project_id: int, kind: str = Form(...), source: str = Form(...), input_text: str = Form(...)):
-    rules = build_rules_preamble(project_id)
-    title = input_text[:40] + "..." if len(input_text) > 40 else input_text
-    prompt = create_general_review_prompt(rules, input_text) if kind == "general" else create_proofread_prompt(input_text)
-    
-    try:
-        text_model = get_text_model()
-        result = text_model.generate_content(prompt).text
-        with Session(engine) as session:
-            review_obj = Review(
-                project_id=project_id, 
-                kind=kind, 
-                source=source, 
-                title=title, 
-                result=result, 
-                input_size=len(input_text), 
-                input_text=input_text
-            )
-            session.add(review_obj)
-            session.commit()
-        return JSONResponse({"ok": True, "result": result})
-    except Exception as e:
-        return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
+async def run_review(project_id: int, kind: str = Form(...), source: str = Form(...), input_text: str = Form(...)):
+    # Long texts go through the map-reduce pipeline; progress and the result come from /api/jobs
+    job_id = start_review(project_id, kind, source, input_text)
+    return JSONResponse({"ok": True, "job_id": job_id})
 
 @router.get("/reviews/{project_id}")
-def list_reviews(project_id: int, kind: str = ""):
+def list_reviews(project_id: int, kind: str = "", before_id: Optional[int] = None, limit: int = PAGE_DEFAULT_LIMIT,
+                 fields: str = ""):
+    where = [Review.project_id == project_id]
+    if kind:
+        where.append(Review.kind == kind)
+    with Session(engine) as session:
+        page = keyset_page(session, Review, where, parse_fields(fields, REVIEW_FIELDS, REVIEW_LIST_FIELDS), before_id, limit)
+    return JSONResponse(page)
+
+@router.get("/review/{pid}/detail/{review_id}")
+def get_review(pid: int, review_id: int):
     with Session(engine) as session:
-        q = select(Review).where(Review.project_id == project_id).order_by(Review.created_at.desc())
-        if kind: 
-            q = q.where(Review.kind == kind)
-        rows = session.exec(q).all()
-    return JSONResponse({"items": [r.model_dump(mode='json') for r in rows]})
+        r = session.get(Review, review_id)
+        if not r or r.project_id != pid:
+            return JSONResponse({"ok": False, "error": "Review not found"}, status_code=404)
+        return JSONResponse({"ok": True, "item": r.model_dump(mode='json')})
 
 @router.post("/reviews/{pid}/delete")
 def delete_review(pid: int, id: int = Form(...)):
@@ -61,41 +57,56 @@ def get_review_discussion(review_id: int):
         msgs = session.exec(select(ReviewDiscussion).where(ReviewDiscussion.review_id == review_id).order_by(ReviewDiscussion.created_at.asc())).all()
     return JSONResponse({"items": [m.model_dump(mode='json') for m in msgs]})
 
-@router.post("/review/{pid}/discuss")
-def post_review_discussion(pid: int, review_id: int = Form(...), question: str = Form(...)):
+def _get_review(review_id: int) -> Optional[Review]:
     with Session(engine) as session:
-        rev = session.get(Review, review_id)
-        if not rev: 
-            return JSONResponse({"ok": False}, 404)
-        
-        session.add(ReviewDiscussion(project_id=pid, review_id=rev.id, role="user", message=question))
-        session.commit()
-        
-        prompt = create_review_discussion_prompt(rev, question)
-        text_model = get_text_model()
-        answer = text_model.generate_content(contents=[prompt]).text
-        
-        session.add(ReviewDiscussion(project_id=pid, review_id=rev.id, role="assistant", message=answer))
+        return session.get(Review, review_id)
+
+def _add_discussion(pid: int, review_id: int, role: str, message: str):
+    with Session(engine) as session:
+        session.add(ReviewDiscussion(project_id=pid, review_id=review_id, role=role, message=message))
         session.commit()
-    return JSONResponse({"ok": True})
 
-@router.post("/review/{pid}/update_from_discussion")
-def update_review(pid: int, review_id: int = Form(...)):
+def _discussion_thread(review_id: int) -> str:
+    with Session(engine) as session:
+        discussions = session.exec(select(ReviewDiscussion).where(ReviewDiscussion.review_id == review_id).order_by(ReviewDiscussion.created_at.asc())).all()
+        return "\n".join([f"{d.role}: {d.message}" for d in discussions])
+
+def _save_review_result(review_id: int, result: str):
     with Session(engine) as session:
         rev = session.get(Review, review_id)
-        if not rev: 
-            return JSONResponse({"ok": False, "error": "Review not found"}, status_code=404)
-        
-        discussions = session.exec(select(ReviewDiscussion).where(ReviewDiscussion.review_id == rev.id).order_by(ReviewDiscussion.created_at.asc())).all()
-        thread = "\n".join([f"{d.role}: {d.message}" for d in discussions])
-        prompt = create_review_update_prompt(rev, thread)
-        
-        try:
-            text_model = get_text_model()
-            new_result = text_model.generate_content(prompt).text
-            rev.result = new_result
+        if rev:
+            rev.result = result
             session.add(rev)
             session.commit()
-            return JSONResponse({"ok": True})
-        except Exception as e:
-            return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
+
+# Database steps run in the threadpool, each with its own session, so no connection is held
+# while the model answers
+@router.post("/review/{pid}/discuss")
+async def post_review_discussion(pid: int, review_id: int = Form(...), question: str = Form(...)):
+    rev = await run_in_threadpool(_get_review, review_id)
+    if not rev: 
+        return JSONResponse({"ok": False}, 404)
+    
+    await run_in_threadpool(_add_discussion, pid, rev.id, "user", question)
+    
+    prompt = create_review_discussion_prompt(rev, question)
+    answer = await generate_text(prompt)
+    
+    await run_in_threadpool(_add_discussion, pid, rev.id, "assistant", answer)
+    return JSONResponse({"ok": True})
+
+@router.post("/review/{pid}/update_from_discussion")
+async def update_review(pid: int, review_id: int = Form(...)):
+    rev = await run_in_threadpool(_get_review, review_id)
+    if not rev: 
+        return JSONResponse({"ok": False, "error": "Review not found"}, status_code=404)
+    
+    thread = await run_in_threadpool(_discussion_thread, rev.id)
+    prompt = create_review_update_prompt(rev, thread)
+    
+    try:
+        new_result = await generate_text(prompt)
+        await run_in_threadpool(_save_review_result, rev.id, new_result)
+        return JSONResponse({"ok": True})
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
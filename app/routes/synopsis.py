@@ -1,16 +1,21 @@
 # app/routes/synopsis.py
 import json
 import re
+from typing import Optional
 from fastapi import APIRouter, Form
 from fastapi.responses import JSONResponse
 from sqlmodel import Session, select, delete
 
 from app.database import engine
 from app.models import Project, SynopsisHistory
-from app.services import get_text_model
+from app.services import generate_text
+from app.pagination import keyset_page, parse_fields
 from prompts import create_synopsis_update_prompt, create_division_update_prompt, create_chapter_summary_prompt
 
 router = APIRouter()
+SYNOPSIS_HISTORY_FIELDS = ("id", "project_id", "text", "created_at")
+# Every version holds a full synopsis, so pages are kept short
+SYNOPSIS_HISTORY_PAGE_LIMIT = 10
 
 @router.get("/project/{project_id}/synopsis")
 def get_synopsis(project_id: int):
@@ -34,10 +39,12 @@ def save_synopsis(project_id: int, text: str = Form("")):
     return JSONResponse({"ok": False, "error": "Project not found"}, status_code=404)
 
 @router.get("/api/project/{project_id}/synopsis_history")
-def get_synopsis_history(project_id: int):
+def get_synopsis_history(project_id: int, before_id: Optional[int] = None, limit: int = SYNOPSIS_HISTORY_PAGE_LIMIT,
+                         fields: str = ""):
     with Session(engine) as session:
-        history = session.exec(select(SynopsisHistory).where(SynopsisHistory.project_id == project_id).order_by(SynopsisHistory.created_at.desc())).all()
-    return JSONResponse({"items": [h.model_dump(mode='json') for h in history]})
+        page = keyset_page(session, SynopsisHistory, [SynopsisHistory.project_id == project_id],
+                           parse_fields(fields, SYNOPSIS_HISTORY_FIELDS, SYNOPSIS_HISTORY_FIELDS), before_id, limit)
+    return JSONResponse(page)
 
 @router.post("/api/project/{project_id}/synopsis_history/clear")
 def clear_synopsis_history(project_id: int):
@@ -86,34 +93,34 @@ def save_draft(project_id: int, draft_text: str = Form(""), discussion_thread: s
     return JSONResponse({"ok": False}, status_code=404)
 
 @router.post("/api/project/{project_id}/summarize_chapter_discussion")
-def summarize_chapter_discussion(project_id: int, original_content: str = Form(...), discussion_thread: str = Form(...), full_synopsis: str = Form(...)):
+async def summarize_chapter_discussion(project_id: int, original_content: str = Form(...), discussion_thread: str = Form(...), full_synopsis: str = Form(...)):
     try:
         thread_data = json.loads(discussion_thread)
         thread_str = "\n".join([f"{t['role']}: {t['content']}" for t in thread_data])
         prompt = create_chapter_summary_prompt(original_content, thread_str, full_synopsis)
-        response = get_text_model().generate_content(prompt)
-        return JSONResponse({"ok": True, "updated_content": response.text})
+        updated_content = await generate_text(prompt)
+        return JSONResponse({"ok": True, "updated_content": updated_content})
     except Exception as e:
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
 
 @router.post("/api/project/{project_id}/update_synopsis_from_discussion")
-def update_synopsis_from_discussion(project_id: int, current_draft: str = Form(...), discussion_thread: str = Form(...)):
+async def update_synopsis_from_discussion(project_id: int, current_draft: str = Form(...), discussion_thread: str = Form(...)):
     try:
         thread_data = json.loads(discussion_thread)
         thread_str = "\n".join([f"{t['role']}: {t['content']}" for t in thread_data])
         prompt = create_synopsis_update_prompt(current_draft, thread_str)
-        response = get_text_model().generate_content(prompt)
-        return JSONResponse({"ok": True, "updated_synopsis": response.text})
+        updated_synopsis = await generate_text(prompt)
+        return JSONResponse({"ok": True, "updated_synopsis": updated_synopsis})
     except Exception as e:
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
 
 @router.post("/api/project/{project_id}/update_division_from_discussion")
-def update_division_from_discussion(project_id: int, original_division: str = Form(...), discussion_thread: str = Form(...)):
+async def update_division_from_discussion(project_id: int, original_division: str = Form(...), discussion_thread: str = Form(...)):
     try:
         thread_data = json.loads(discussion_thread)
         thread_str = "\n".join([f"{t['role']}: {t['content']}" for t in thread_data])
         prompt = create_division_update_prompt(original_division, thread_str)
-        response = get_text_model().generate_content(prompt)
-        return JSONResponse({"ok": True, "updated_division": response.text})
+        updated_division = await generate_text(prompt)
+        return JSONResponse({"ok": True, "updated_division": updated_division})
     except Exception as e:
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
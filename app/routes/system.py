@@ -0,0 +1,21 @@
+# app/routes/system.py
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.cache import embedding_cache, response_cache
+from app.database import sqlite_profile
+from app.utils import index_cache
+
+router = APIRouter(prefix="/api/system")
+
+@router.get("/cache_stats")
+def cache_stats():
+    return JSONResponse({
+        "vector_index": index_cache.stats(),
+        "embeddings": embedding_cache.stats(),
+        "llm_responses": response_cache.stats(),
+    })
+
+@router.get("/db_profile")
+def db_profile():
+    return JSONResponse(sqlite_profile())
@@ -1,13 +1,17 @@
 # app/services.py
 import os
+import json
+import asyncio
+import dataclasses
 import google.generativeai as genai
-from typing import Optional
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, List, Optional
 from PIL import Image
 from sqlmodel import Session, select
 
+from app.cache import response_cache
 from app.database import engine
 from app.models import Rule
-from prompts import create_image_rewrite_prompt
+from prompts import create_image_prompt_compile_prompt
 
 # ====== Constants & SDK Init ======
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY", "")
@@ -16,6 +20,13 @@ GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY", "")
 TEXT_MODEL_API_NAME = "gemini-2.5-pro"
 IMAGE_MODEL_API_NAME = "gemini-2.5-flash-image-preview"
 
+# Upper bound on in-flight Gemini calls; requests beyond this wait on the semaphore
+# instead of pinning threadpool workers.
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "16"))
+IMAGE_MAX_CONCURRENCY = int(os.environ.get("IMAGE_MAX_CONCURRENCY", "4"))
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+image_semaphore = asyncio.Semaphore(IMAGE_MAX_CONCURRENCY)
+
 genai.configure(api_key=GOOGLE_API_KEY)
 
 # This block now includes a fallback to a stable model
@@ -39,6 +50,65 @@ def get_text_model():
         raise RuntimeError("Text model could not be initialized, not even the fallback.")
     return text_model
 
+def _config_key(generation_config) -> str:
+    if generation_config is None:
+        return ""
+    if dataclasses.is_dataclass(generation_config):
+        generation_config = dataclasses.asdict(generation_config)
+    return json.dumps(generation_config, sort_keys=True, default=str)
+
+async def generate_text(prompt: str, generation_config=None, cache: bool = False) -> str:
+    # cache=True is for calls whose answer depends only on the prompt (translation, prompt
+    # rewriting, extraction, proofreading): the response is stored in the persistent
+    # response cache and the same call is served from it until the entry expires
+    model = get_text_model()
+    if cache:
+        key = response_cache.key_for(prompt, _config_key(generation_config))
+        # The cache is SQLite, so lookups and writes run off the event loop
+        cached = await asyncio.to_thread(response_cache.get, model.model_name, key)
+        if cached is not None:
+            return cached
+    async with llm_semaphore:
+        response = await model.generate_content_async(contents=[prompt], generation_config=generation_config)
+    text = response.text
+    if cache and text:
+        await asyncio.to_thread(response_cache.put, model.model_name, key, text)
+    return text
+
+async def stream_text(prompt: str, generation_config=None) -> AsyncIterator[str]:
+    async with llm_semaphore:
+        response = await get_text_model().generate_content_async(
+            contents=[prompt], generation_config=generation_config, stream=True)
+        async for chunk in response:
+            try:
+                piece = chunk.text
+            except ValueError:
+                # Chunks that carry only metadata (finish reason, safety ratings) have no text part
+                continue
+            if piece:
+                yield piece
+
+async def ndjson_text_stream(pieces: AsyncIterable[str], on_complete: Optional[Callable[[str], Awaitable[str]]] = None,
+                             meta: Optional[dict] = None) -> AsyncIterator[str]:
+    # One JSON object per line: {"delta": ...} for every piece, then {"done": true, "text": ...}
+    # with the full (optionally post-processed) text and any meta, or {"error": ...} if the
+    # model call fails.
+    parts = []
+    try:
+        async for piece in pieces:
+            parts.append(piece)
+            yield json.dumps({"delta": piece}, ensure_ascii=False) + "\n"
+        text = "".join(parts)
+        if on_complete:
+            text = await on_complete(text)
+        done = {"done": True, "text": text}
+        if meta:
+            done["meta"] = meta
+        yield json.dumps(done, ensure_ascii=False) + "\n"
+    except Exception as e:
+        print(f"Error while streaming model output: {e}")
+        yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+
 def build_rules_preamble(project_id: int) -> str:
     with Session(engine) as session:
         rules = session.exec(select(Rule).where((Rule.project_id == None) | (Rule.project_id == project_id))).all()
@@ -46,44 +116,44 @@ def build_rules_preamble(project_id: int) -> str:
     if not enforced: return ""
     return "עליך לציית לכללים הבאים באופן מוחלט ומדויק:\n- " + "\n- ".join(enforced) + "\n\n"
 
-def rewrite_prompt_for_image_generation(raw_prompt: str) -> str:
-    print(f"Rewriting raw prompt: '{raw_prompt}'")
-    meta_prompt = create_image_rewrite_prompt(raw_prompt)
+async def compile_image_prompt(description: str, style: str = "", consistency_notes: Optional[List[str]] = None) -> str:
+    # Translation and rewriting in one text call. The response is cached, so regenerating
+    # an image for the same (description, style, matched objects) makes no text call at all.
+    meta_prompt = create_image_prompt_compile_prompt(description, style, sorted(consistency_notes or []))
     try:
-        rewrite_model = get_text_model()
-        response = rewrite_model.generate_content(meta_prompt)
-        rewritten_prompt = response.text.strip()
-        print(f"Rewritten prompt: '{rewritten_prompt}'")
-        return rewritten_prompt
+        final_prompt = (await generate_text(meta_prompt, cache=True)).strip()
+        print(f"Compiled image prompt: '{final_prompt}'")
+        return final_prompt
     except Exception as e:
-        print(f"Error during prompt rewrite: {e}")
-        raise RuntimeError(f"Prompt rewriting failed. Error: {e}") from e
-
-def generate_image_with_gemini(prompt: str, source_image: Optional[Image.Image] = None) -> bytes:
-    try:
-        print(f"Attempting to generate image with {IMAGE_MODEL_API_NAME}. Prompt: '{prompt}'")
-        image_model = genai.GenerativeModel(IMAGE_MODEL_API_NAME)
-        content = [prompt, source_image] if source_image else [prompt]
-        response = image_model.generate_content(content)
-
-        if response.parts:
-            for part in response.parts:
-                if part.inline_data and part.inline_data.data:
-                    return part.inline_data.data
-        if response.prompt_feedback and response.prompt_feedback.block_reason:
-            raise RuntimeError(f"Image request blocked: {response.prompt_feedback.block_reason.name}")
-        raise RuntimeError("No image data returned from Gemini.")
+        print(f"Error during prompt compilation: {e}")
+        raise RuntimeError(f"Prompt compilation failed. Error: {e}") from e
 
-    except Exception as e:
-        print(f"An error occurred in generate_image_with_gemini with model '{IMAGE_MODEL_API_NAME}': {e}")
-        print("Fallback: Retrying image generation with gemini-1.5-pro-latest.")
+async def generate_image_with_gemini(prompt: str, source_image: Optional[Image.Image] = None) -> bytes:
+    async with image_semaphore:
         try:
-            image_model = genai.GenerativeModel("gemini-1.5-pro-latest")
-            response = image_model.generate_content([prompt, source_image] if source_image else [prompt])
+            print(f"Attempting to generate image with {IMAGE_MODEL_API_NAME}. Prompt: '{prompt}'")
+            image_model = genai.GenerativeModel(IMAGE_MODEL_API_NAME)
+            content = [prompt, source_image] if source_image else [prompt]
+            response = await image_model.generate_content_async(content)
+
             if response.parts:
                 for part in response.parts:
                     if part.inline_data and part.inline_data.data:
                         return part.inline_data.data
-            raise RuntimeError(f"Image generation failed on both models. Original error: {e}")
-        except Exception as fallback_e:
-             raise RuntimeError(f"Image generation fallback also failed. Error: {fallback_e}")
+            if response.prompt_feedback and response.prompt_feedback.block_reason:
+                raise RuntimeError(f"Image request blocked: {response.prompt_feedback.block_reason.name}")
+            raise RuntimeError("No image data returned from Gemini.")
+
+        except Exception as e:
+            print(f"An error occurred in generate_image_with_gemini with model '{IMAGE_MODEL_API_NAME}': {e}")
+            print("Fallback: Retrying image generation with gemini-1.5-pro-latest.")
+            try:
+                image_model = genai.GenerativeModel("gemini-1.5-pro-latest")
+                response = await image_model.generate_content_async([prompt, source_image] if source_image else [prompt])
+                if response.parts:
+                    for part in response.parts:
+                        if part.inline_data and part.inline_data.data:
+                            return part.inline_data.data
+                raise RuntimeError(f"Image generation failed on both models. Original error: {e}")
+            except Exception as fallback_e:
+                 raise RuntimeError(f"Image generation fallback also failed. Error: {fallback_e}")
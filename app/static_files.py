@@ -0,0 +1,100 @@
+# app/static_files.py
+# StaticFiles with caching headers. Starlette already answers Range requests and
+# If-None-Match / If-Modified-Since (304) from the ETag and Last-Modified it sets; these
+# subclasses add Cache-Control. /media and /library files are named by uuid and never
+# rewritten, so they are immutable. /static keeps stable names and is revalidated on every
+# load, and its text assets are served from precompressed .br / .gz siblings when the
+# client accepts them. Brotli is optional: without the brotli package only .gz is written.
+import os
+import gzip
+import mimetypes
+from fastapi.concurrency import run_in_threadpool
+from fastapi.staticfiles import StaticFiles
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE_CACHE_CONTROL = os.environ.get("IMMUTABLE_CACHE_CONTROL", "public, max-age=31536000, immutable")
+STATIC_CACHE_CONTROL = os.environ.get("STATIC_CACHE_CONTROL", "no-cache")
+PRECOMPRESS_EXTS = {".js", ".css", ".html", ".svg", ".json", ".map", ".txt"}
+PRECOMPRESS_MIN_BYTES = 1024
+CACHEABLE_STATUSES = {200, 206, 304}
+# Preferred first
+ENCODINGS = ([("br", ".br")] if brotli else []) + [("gzip", ".gz")]
+
+
+class CachedStaticFiles(StaticFiles):
+    def __init__(self, *args, cache_control: str = IMMUTABLE_CACHE_CONTROL, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control
+
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in CACHEABLE_STATUSES:
+            response.headers["Cache-Control"] = self.cache_control
+        return response
+
+
+def _accepted_encodings(scope) -> set:
+    for name, value in scope.get("headers", []):
+        if name == b"accept-encoding":
+            return {part.split(";")[0].strip() for part in value.decode("latin-1").lower().split(",")}
+    return set()
+
+
+class PrecompressedStaticFiles(CachedStaticFiles):
+    def __init__(self, *args, cache_control: str = STATIC_CACHE_CONTROL, **kwargs):
+        super().__init__(*args, cache_control=cache_control, **kwargs)
+
+    async def get_response(self, path: str, scope):
+        if os.path.splitext(path)[1].lower() not in PRECOMPRESS_EXTS:
+            return await super().get_response(path, scope)
+        accepted = _accepted_encodings(scope)
+        for encoding, suffix in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            full_path, stat_result = await run_in_threadpool(self.lookup_path, path + suffix)
+            _, source_stat = await run_in_threadpool(self.lookup_path, path)
+            # A variant older than its source is stale (the source was edited since)
+            if not stat_result or not source_stat or stat_result.st_mtime < source_stat.st_mtime:
+                continue
+            response = self.file_response(full_path, stat_result, scope)
+            media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            if media_type.startswith("text/") or media_type in ("application/javascript", "application/json", "image/svg+xml"):
+                media_type += "; charset=utf-8"
+            response.headers["Content-Type"] = media_type
+            response.headers["Content-Encoding"] = encoding
+            response.headers["Vary"] = "Accept-Encoding"
+            if response.status_code in CACHEABLE_STATUSES:
+                response.headers["Cache-Control"] = self.cache_control
+            return response
+        response = await super().get_response(path, scope)
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+def precompress_static(directory: str) -> int:
+    # Writes .gz (and .br when brotli is installed) next to every text asset that lacks an
+    # up-to-date one; returns how many variants were written
+    written = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1].lower() not in PRECOMPRESS_EXTS or os.path.getsize(path) < PRECOMPRESS_MIN_BYTES:
+                continue
+            source_mtime = os.path.getmtime(path)
+            for encoding, suffix in ENCODINGS:
+                target = path + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= source_mtime:
+                    continue
+                with open(path, 'rb') as f:
+                    data = f.read()
+                packed = brotli.compress(data, quality=11) if encoding == "br" else gzip.compress(data, compresslevel=9, mtime=0)
+                tmp_path = f"{target}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(packed)
+                os.replace(tmp_path, target)
+                written += 1
+    return written
@@ -0,0 +1,148 @@
+# app/storyboard.py
+# Batch illustration of a whole chapter: the frames of a ChapterOutline (or a list of
+# label/description pairs) are generated as one job. The project's lab objects are loaded
+# once and the same style is applied to every frame. Frames run concurrently (at most
+# STORYBOARD_MAX_CONCURRENCY per batch) but image calls are spaced by a limiter shared by
+# all batches, and a rate-limited call (429 / quota) pushes every batch back before it is
+# retried. At most STORYBOARD_MAX_ACTIVE batches run at once; further requests are refused
+# like a full image queue. Per-frame status is reported in the job's progress.
+import os
+import re
+import time
+import asyncio
+from typing import List, Optional
+
+from app.jobs import jobs
+from app.image_jobs import ImageQueueFullError, render_illustration, load_project_objects
+from app.services import IMAGE_MAX_CONCURRENCY
+
+STORYBOARD_MAX_FRAMES = int(os.environ.get("STORYBOARD_MAX_FRAMES", "200"))
+STORYBOARD_MAX_ACTIVE = int(os.environ.get("STORYBOARD_MAX_ACTIVE", "2"))
+STORYBOARD_MAX_CONCURRENCY = int(os.environ.get("STORYBOARD_MAX_CONCURRENCY", str(IMAGE_MAX_CONCURRENCY)))
+IMAGE_RATE_PER_MINUTE = float(os.environ.get("IMAGE_RATE_PER_MINUTE", "10"))
+STORYBOARD_MAX_RETRIES = int(os.environ.get("STORYBOARD_MAX_RETRIES", "3"))
+STORYBOARD_RETRY_BASE_SECONDS = float(os.environ.get("STORYBOARD_RETRY_BASE_SECONDS", "20"))
+
+COMIC_FRAME = re.compile(r"^[ \t]*(\d+)\.[ \t]*$", re.MULTILINE)
+PROSE_SCENE = re.compile(r"\n(?=\s*(?:\*\*|##)\s*סצנה|\d+\.\s*\*)")
+PROSE_SCENE_HEADING = re.compile(r"^\s*(?:(?:\*\*|##)\s*סצנה|\d+\.\s*\*)")
+VISUAL_NOTE = re.compile(r"\[([^\]]+)\]")
+
+# Running storyboard tasks, referenced here so they are not garbage-collected mid-run
+_tasks = set()
+
+
+class RateLimiter:
+    # Hands out call slots at most rate_per_minute per minute; pause() holds every caller
+    # back, e.g. after the API answered 429
+
+    def __init__(self, rate_per_minute: float):
+        self.interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def pause(self, seconds: float):
+        self._next = max(self._next, time.monotonic() + seconds)
+
+
+image_rate_limiter = RateLimiter(IMAGE_RATE_PER_MINUTE)
+
+
+def split_outline_frames(outline_text: str) -> List[dict]:
+    # Comic scripts: "N." on its own line, then text and a [visual description]; the frame
+    # is drawn from the bracketed visuals, with the text as context. Prose outlines: one
+    # frame per "**סצנה N: title**" block.
+    frames = []
+    marks = list(COMIC_FRAME.finditer(outline_text))
+    if marks:
+        ends = [m.start() for m in marks[1:]] + [len(outline_text)]
+        for m, end in zip(marks, ends):
+            body = outline_text[m.end():end].strip()
+            visuals = VISUAL_NOTE.findall(body)
+            text = VISUAL_NOTE.sub("", body).strip()
+            desc = " ".join(v.strip() for v in visuals) or text
+            if visuals and text:
+                desc = f"{desc} (Frame text, for context only: {text})"
+            if desc:
+                frames.append({"label": f"פריים {m.group(1)}", "description": desc})
+        return frames
+    blocks = PROSE_SCENE.split(outline_text)
+    # Text before the first scene heading (an intro line, the chapter title) is not a frame
+    if blocks and not PROSE_SCENE_HEADING.match(blocks[0]):
+        blocks = blocks[1:]
+    for block in blocks:
+        lines = block.strip().split("\n")
+        title = re.sub(r"[\*#]", "", lines[0]).strip()
+        desc = "\n".join(lines[1:]).strip()
+        if title or desc:
+            frames.append({"label": title or f"סצנה {len(frames) + 1}", "description": desc or title})
+    return frames
+
+def _is_rate_limited(e: Exception) -> bool:
+    text = str(e).lower()
+    return "429" in text or "resource_exhausted" in text or "resource exhausted" in text or "quota" in text
+
+async def _run_storyboard(job_id: str, project_id: int, frames: List[dict], style: str, label_prefix: str):
+    objects = await asyncio.to_thread(load_project_objects, project_id)
+    progress = {"total": len(frames), "done": 0, "failed": 0,
+                "frames": [{"label": f["label"], "status": "queued"} for f in frames]}
+    jobs.update(job_id, status="running", progress=progress)
+    semaphore = asyncio.Semaphore(STORYBOARD_MAX_CONCURRENCY)
+
+    def report(idx: int, **fields):
+        progress["frames"][idx].update(fields)
+        jobs.update(job_id, progress={**progress, "frames": [dict(f) for f in progress["frames"]]})
+
+    async def run_frame(idx: int):
+        frame = frames[idx]
+        scene_label = f"{label_prefix} • {frame['label']}" if label_prefix else frame["label"]
+        async with semaphore:
+            for attempt in range(STORYBOARD_MAX_RETRIES + 1):
+                await image_rate_limiter.acquire()
+                report(idx, status="generating")
+                try:
+                    result = await render_illustration(project_id, frame["description"], style, scene_label, objects=objects)
+                    progress["done"] += 1
+                    report(idx, status="done", url=result["url"], item=result["item"])
+                    return
+                except Exception as e:
+                    if _is_rate_limited(e) and attempt < STORYBOARD_MAX_RETRIES:
+                        delay = STORYBOARD_RETRY_BASE_SECONDS * (2 ** attempt)
+                        image_rate_limiter.pause(delay)
+                        report(idx, status="waiting", retry_in=delay)
+                        continue
+                    print(f"Storyboard {job_id} frame {idx + 1} failed: {e}")
+                    progress["failed"] += 1
+                    report(idx, status="failed", error=str(e))
+                    return
+
+    try:
+        await asyncio.gather(*[run_frame(i) for i in range(len(frames))])
+        result = {"illustration_ids": [f["item"]["id"] for f in progress["frames"] if f.get("item")],
+                  "done": progress["done"], "failed": progress["failed"]}
+        if progress["done"] == 0:
+            jobs.update(job_id, status="failed", error="No frame could be generated.", result=result)
+        else:
+            jobs.update(job_id, status="done", result=result)
+    except Exception as e:
+        print(f"Storyboard job {job_id} failed: {e}")
+        jobs.update(job_id, status="failed", error=str(e))
+
+def start_storyboard(project_id: int, frames: List[dict], style: str = "", label_prefix: str = "",
+                     chapter_title: Optional[str] = None) -> str:
+    # Must be called from the event loop (i.e. an async route)
+    if len(_tasks) >= STORYBOARD_MAX_ACTIVE:
+        raise ImageQueueFullError("Too many storyboards are running, try again shortly.")
+    job_id = jobs.create("storyboard", project_id=project_id, chapter_title=chapter_title, label=label_prefix)
+    task = asyncio.create_task(_run_storyboard(job_id, project_id, frames, style, label_prefix))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return job_id
@@ -0,0 +1,54 @@
+# app/upload_limit.py
+# Caps multipart request bodies before they are parsed. FastAPI spools every uploaded file
+# to disk before the route runs, so the per-file limit in save_upload_file only applies once
+# the whole body has arrived; this rejects an oversized upload from its Content-Length, or
+# stops reading a body sent without one as soon as it passes the cap.
+import os
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from app.utils import MAX_UPLOAD_BYTES
+
+# A request may carry several files (a folder upload), so the default request cap is a
+# multiple of the per-file cap; each file is still held to MAX_UPLOAD_BYTES on its own
+UPLOAD_REQUEST_CAP_MULTIPLE = int(os.environ.get("UPLOAD_REQUEST_CAP_MULTIPLE", "10"))
+MAX_UPLOAD_REQUEST_BYTES = int(os.environ.get("MAX_UPLOAD_REQUEST_MB", str(UPLOAD_REQUEST_CAP_MULTIPLE * MAX_UPLOAD_BYTES // (1024 * 1024)))) * 1024 * 1024
+
+
+def _too_large_message(max_bytes: int) -> str:
+    return f"The upload exceeds the {max_bytes // (1024 * 1024)}MB limit."
+
+
+class UploadLimitMiddleware:
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers", []))
+        if not headers.get(b"content-type", b"").lower().startswith(b"multipart/"):
+            return await self.app(scope, receive, send)
+
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            message = _too_large_message(self.max_bytes)
+            # Same shape as the upload routes' own partial-failure answer
+            response = JSONResponse({"ok": False, "error": message, "errors": [{"filename": None, "error": message}],
+                                     "file_ids": [], "filenames": [], "files": [], "job_ids": []}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI re-raises HTTPExceptions from body parsing as they are
+                    raise HTTPException(status_code=413, detail=_too_large_message(self.max_bytes))
+            return message
+
+        await self.app(scope, limited_receive, send)
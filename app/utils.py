@@ -1,16 +1,31 @@
 # app/utils.py
 import os
 import re
+import hashlib
 import shutil
-import docx
-import PyPDF2
+import threading
+from collections import OrderedDict
+from typing import Iterable
+from fastapi.concurrency import run_in_threadpool
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 
+from app.cache import CachedEmbeddings, embedding_cache
+
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY", "")
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=GOOGLE_API_KEY)
+EMBEDDING_MODEL_NAME = "models/embedding-001"
+embeddings = CachedEmbeddings(
+    GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL_NAME, google_api_key=GOOGLE_API_KEY),
+    EMBEDDING_MODEL_NAME, embedding_cache,
+)
 VECTORSTORE_ROOT = "vectorstores"
+VECTOR_INDEX_CACHE_MAX_ENTRIES = int(os.environ.get("VECTOR_INDEX_CACHE_MAX_ENTRIES", "32"))
+VECTOR_INDEX_CACHE_MAX_MB = int(os.environ.get("VECTOR_INDEX_CACHE_MAX_MB", "512"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_MB", "200")) * 1024 * 1024
+EMBED_BATCH_CHARS = int(os.environ.get("EMBED_BATCH_CHARS", "200000"))
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
 
 def _clean_ai_division_output(raw_text: str) -> str:
     match = re.search(r"פרק\s+\d+", raw_text)
@@ -28,36 +43,171 @@ def _safe_join_under(base: str, path_rel: str) -> str:
 def _guess_ext(filename: str) -> str:
     return (os.path.splitext(filename)[1] or "").lower()
 
-def extract_text_from_file(file_path: str) -> str:
-    ext = _guess_ext(file_path)
-    text = ""
+class UploadTooLargeError(ValueError):
+    pass
+
+async def save_upload_file(upload, dest_path: str, max_bytes: int = MAX_UPLOAD_BYTES):
+    # Copies an UploadFile to disk in fixed-size chunks, hashing as it goes, and aborts as soon
+    # as the file passes max_bytes. Returns (size, sha256 hex digest).
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLargeError(f"{upload.filename} exceeds the {max_bytes // (1024 * 1024)}MB upload limit.")
+    digest = hashlib.sha256()
+    size = 0
+    # File I/O runs in the threadpool so a large upload does not stall the event loop
+    f = await run_in_threadpool(open, dest_path, "wb")
     try:
-        if ext == '.pdf':
-            with open(file_path, 'rb') as f:
-                reader = PyPDF2.PdfReader(f)
-                for page in reader.pages:
-                    text += page.extract_text() or ""
-        elif ext == '.docx':
-            doc = docx.Document(file_path)
-            for para in doc.paragraphs:
-                text += para.text + "\n"
-        elif ext == '.txt':
-            with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-    except Exception as e:
-        print(f"Error extracting text from {file_path}: {e}")
-        return f"Error reading file: {os.path.basename(file_path)}"
-    return text
-
-def create_vector_index(text: str, index_path: str):
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    docs = text_splitter.split_text(text)
-    db = FAISS.from_texts(docs, embeddings)
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLargeError(f"{upload.filename} exceeds the {max_bytes // (1024 * 1024)}MB upload limit.")
+            digest.update(chunk)
+            await run_in_threadpool(f.write, chunk)
+        await run_in_threadpool(f.close)
+    except BaseException:
+        f.close()
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    return size, digest.hexdigest()
+
+class VectorIndexCache:
+    # LRU of loaded FAISS stores keyed by index path, bounded by entry count and by the
+    # on-disk size of index.faiss + index.pkl. The file stamp is re-checked on every hit.
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()  # key -> (db, size, stamp)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(index_path: str) -> str:
+        return os.path.abspath(index_path)
+
+    @staticmethod
+    def _stamp(index_path: str):
+        try:
+            st_faiss = os.stat(os.path.join(index_path, "index.faiss"))
+            st_pkl = os.stat(os.path.join(index_path, "index.pkl"))
+        except OSError:
+            return None
+        return (st_faiss.st_mtime_ns, st_faiss.st_size, st_pkl.st_mtime_ns, st_pkl.st_size)
+
+    def get(self, index_path: str):
+        key = self._key(index_path)
+        stamp = self._stamp(index_path)
+        if stamp is None:
+            self.invalidate(index_path)
+            return None
+        with self._lock:
+            entry = self._items.get(key)
+            if entry and entry[2] == stamp:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        db = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+        size = stamp[1] + stamp[3]
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old:
+                self._bytes -= old[1]
+            if size <= self.max_bytes:
+                self._items[key] = (db, size, stamp)
+                self._bytes += size
+                self._evict()
+        return db
+
+    def invalidate(self, index_path: str):
+        with self._lock:
+            old = self._items.pop(self._key(index_path), None)
+            if old:
+                self._bytes -= old[1]
+
+    def _evict(self):
+        while self._items and (len(self._items) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, size, _) = self._items.popitem(last=False)
+            self._bytes -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+index_cache = VectorIndexCache(VECTOR_INDEX_CACHE_MAX_ENTRIES, VECTOR_INDEX_CACHE_MAX_MB * 1024 * 1024)
+
+def _chunk_id(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+def create_vector_index_from_pages(pages: Iterable[str], index_path: str, on_first_batch=None) -> bool:
+    # Chunks and embeds every EMBED_BATCH_CHARS of text as it arrives, so embedding overlaps
+    # with extraction of the later pages. Returns False (and writes nothing) for empty text.
+    db = None
+
+    def flush(text: str):
+        nonlocal db
+        docs = text_splitter.split_text(text)
+        if not docs:
+            return
+        if db is None:
+            if on_first_batch:
+                on_first_batch()
+            db = FAISS.from_texts(docs, embeddings)
+        else:
+            db.add_texts(docs)
+
+    buffer = []; buffered = 0
+    for page in pages:
+        buffer.append(page); buffered += len(page)
+        if buffered >= EMBED_BATCH_CHARS:
+            flush("\n".join(buffer))
+            buffer = []; buffered = 0
+    flush("\n".join(buffer))
+    if db is None:
+        return False
     db.save_local(index_path)
+    index_cache.invalidate(index_path)
+    return True
+
+def update_vector_index(text: str, index_path: str) -> dict:
+    # Docstore ids are the sha256 of each chunk, so the ids already in the index are the
+    # chunk hashes of the last build: only new chunks get embedded, vanished ones are deleted.
+    wanted = {}
+    for chunk in text_splitter.split_text(text):
+        wanted.setdefault(_chunk_id(chunk), chunk)
+    if not wanted:
+        remove_vector_index(index_path)
+        return {"added": 0, "removed": 0, "kept": 0}
+
+    if not os.path.exists(os.path.join(index_path, "index.faiss")):
+        db = FAISS.from_texts(list(wanted.values()), embeddings, ids=list(wanted.keys()))
+        stats = {"added": len(wanted), "removed": 0, "kept": 0}
+    else:
+        db = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+        existing = set(db.index_to_docstore_id.values())
+        stale = [i for i in existing if i not in wanted]
+        fresh = [i for i in wanted if i not in existing]
+        stats = {"added": len(fresh), "removed": len(stale), "kept": len(existing) - len(stale)}
+        if not stale and not fresh:
+            return stats
+        if stale:
+            db.delete(stale)
+        if fresh:
+            db.add_texts([wanted[i] for i in fresh], ids=fresh)
+    db.save_local(index_path)
+    index_cache.invalidate(index_path)
+    return stats
+
+def remove_vector_index(index_path: str):
+    if not index_path:
+        return
+    if os.path.exists(index_path):
+        shutil.rmtree(index_path)
+    index_cache.invalidate(index_path)
 
-def get_relevant_context_from_index(query: str, index_path: str, k=4) -> str:
-    if not os.path.exists(index_path):
-        return ""
-    db = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
-    results = db.similarity_search(query, k=k)
-    return "\n---\n".join([doc.page_content for doc in results])
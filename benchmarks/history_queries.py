@@ -0,0 +1,76 @@
+# benchmarks/history_queries.py
+# Seeds a scratch SQLite DB with 100k History rows spread over a few hundred projects and
+# times the chat queries with and without the indexes declared in app/models.py.
+#
+#   python benchmarks/history_queries.py [rows] [projects]
+import os
+import sys
+import time
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlmodel import SQLModel, Session, create_engine, select
+from app.models import History
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+PROJECTS = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+REPEAT = 200
+
+QUERIES = {
+    "chat (all turns)": lambda pid: select(History).where(History.project_id == pid).order_by(History.created_at.desc()),
+    "ask (last 10 turns)": lambda pid: select(History).where(History.project_id == pid).order_by(History.created_at.desc()).limit(10),
+    "history (questions)": lambda pid: select(History.question).where(History.project_id == pid).order_by(History.created_at.desc()),
+}
+
+
+def seed(engine):
+    start = datetime(2024, 1, 1)
+    rows = [
+        {"project_id": random.randint(1, PROJECTS), "question": f"question {i}", "answer": "answer " * 40,
+         "created_at": start + timedelta(seconds=i)}
+        for i in range(ROWS)
+    ]
+    with engine.begin() as conn:
+        conn.execute(History.__table__.insert(), rows)
+
+
+def run(engine, label):
+    print(f"\n{label}")
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN SELECT * FROM history WHERE project_id = 1 ORDER BY created_at DESC LIMIT 10"
+        ).fetchall()
+    print("  plan:", "; ".join(row[-1] for row in plan))
+    project_ids = [random.randint(1, PROJECTS) for _ in range(REPEAT)]
+    for name, build in QUERIES.items():
+        with Session(engine) as session:
+            t0 = time.perf_counter()
+            for pid in project_ids:
+                session.exec(build(pid)).all()
+            elapsed = time.perf_counter() - t0
+        print(f"  {name:<22} {elapsed / REPEAT * 1000:8.2f} ms/query")
+
+
+def main():
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}")
+        SQLModel.metadata.create_all(engine, tables=[History.__table__])
+        t0 = time.perf_counter()
+        seed(engine)
+        print(f"seeded {ROWS} history rows over {PROJECTS} projects in {time.perf_counter() - t0:.1f}s")
+
+        run(engine, "with indexes")
+        with engine.begin() as conn:
+            for index in History.__table__.indexes:
+                index.drop(conn)
+        engine.dispose()
+        run(engine, "without indexes")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -101,6 +101,26 @@ def create_general_review_prompt(rules: str, text: str) -> str:
 def create_proofread_prompt(text: str) -> str:
     return f"בצע הגהה על הטקסט המלא הבא ותקן שגיאות כתיב, דקדוק ופיסוק:\n\n{text}"
 
+def create_review_chunk_prompt(rules: str, kind: str, text: str) -> str:
+    # No position in the text: results are cached by content and reused wherever the chunk lands
+    if kind == "general":
+        return f"{rules}לפניך חלק אחד מתוך כתב יד מלא. בצע ביקורת ספרותית על חלק זה בלבד: עלילה, דמויות, קצב, סגנון ועקביות. ציין ממצאים קונקרטיים עם הפניה למקום בטקסט, כדי שניתן יהיה לאחד אותם לדוח אחד.\nהחלק לבדיקה:\n{text}"
+    return f"לפניך חלק אחד מתוך טקסט ארוך. בצע הגהה על חלק זה ותקן שגיאות כתיב, דקדוק ופיסוק. רשום כל תיקון עם הציטוט המקורי והנוסח המתוקן:\n\n{text}"
+
+def create_review_synthesis_prompt(rules: str, kind: str, parts: list) -> str:
+    joined = "\n\n---\n\n".join(f"חלק {i}:\n{part}" for i, part in enumerate(parts, 1))
+    if kind == "general":
+        return f"{rules}להלן ממצאי ביקורת שנכתבו על כל חלקי כתב היד בנפרד. אחד אותם לדוח ביקורת ספרותית מקיף אחד על הסיפור כולו: חוזקות, חולשות, בעיות שחוזרות לאורך הספר והמלצות מסודרות לפי חשיבות. אל תחזור על ממצאים כפולים.\n\n{joined}"
+    return f"להלן תוצאות הגהה שנעשו על כל חלקי הטקסט בנפרד. אחד אותן לרשימת תיקונים אחת מסודרת לפי סדר הופעה בטקסט, בלי כפילויות.\n\n{joined}"
+
+def create_history_summary_prompt(previous_summary: str, turns: list) -> str:
+    joined = "\n".join(f"ש: {q}\nת: {a}" for q, a in turns)
+    previous = f"הסיכום עד כה:\n{previous_summary}\n\n" if previous_summary else ""
+    return f"""אתה מתחזק סיכום מתגלגל של שיחת עבודה על פרויקט כתיבה. {previous}להלן חילופי דברים חדשים שטרם נכללו בסיכום:
+{joined}
+
+כתוב סיכום מעודכן אחד שמשלב את הסיכום הקיים עם החילופים החדשים. שמור על החלטות שהתקבלו, רעיונות שאומצו או נדחו, שמות, עובדות על הדמויות והעולם ובקשות פתוחות. השמט ניסוחים ופרטים שאינם משפיעים על המשך העבודה. החזר את הסיכום בלבד, בלא יותר מ-400 מילים."""
+
 def create_review_discussion_prompt(review, question: str) -> str:
     return f"""אתה מנהל דיון על דוח ביקורת שכתבת...הטקסט המקורי שנבדק:
 ---
@@ -127,15 +147,20 @@ def create_review_update_prompt(review, discussion_thread: str) -> str:
 ---
 אנא כתוב גרסה חדשה, מתוקנת ומשופרת של דוח הביקורת..."""
 
-def create_image_rewrite_prompt(raw_prompt: str) -> str:
+def create_image_prompt_compile_prompt(description: str, style: str = "", consistency_notes: list = None) -> str:
+    style_line = f"\nThe requested art style is: '{style}'" if style else ""
+    notes = "\n".join(consistency_notes or [])
+    notes_block = f"\nThese recurring characters/objects appear in the scene and must match their reference descriptions:\n{notes}" if notes else ""
     return f"""
-You are a "prompt engineer". You will receive an image description from a user. Your task is to rewrite it into a detailed, visual, and safe prompt for an image generation model.
+You are a "prompt engineer". You will receive an image description from a user, possibly written in Hebrew. Your task is to turn it into a single detailed, visual, and safe English prompt for an image generation model.
+Translate the description to English as part of the rewrite; the final prompt must be in English only.
 Focus on visual characteristics: appearance, clothing, environment, lighting, and style.
 Instead of using potentially sensitive words directly, describe the subject's apparent age and features.
 The goal is to honor the user's intent while ensuring the prompt is safe for generation.
-Return ONLY the rewritten prompt, without any preamble.
-
-The user's original description is: '{raw_prompt}'
+If a style is given, open the prompt with it. If reference descriptions are given, weave them into the prompt so those characters look the same as in their references.
+Return ONLY the final prompt, without any preamble.
+{style_line}{notes_block}
+The user's original description is: '{description}'
 """
 
 def create_chapter_summary_prompt(original_content: str, discussion_thread: str, full_synopsis: str) -> str:
@@ -22,6 +22,93 @@ async function get(url) {
     return res.json();
 }
 
+// Upload routes answer with per-file {errors} even when they fail; a request rejected before
+// it reached the route (e.g. over the size cap) only has {detail}, so it is mapped to errors.
+async function postForm(url, formData) {
+    const res = await fetch(url, { method: "POST", body: formData });
+    const data = await res.json().catch(() => ({}));
+    if (!res.ok && !data.errors) {
+        return { ok: false, errors: [{ error: data.detail || data.error || 'Server Error' }] };
+    }
+    return data;
+}
+
+// List endpoints are keyset-paged: pass the previous page's next_before_id to get the next one.
+function pageQuery(beforeId, extra = {}) {
+    const params = new URLSearchParams(extra);
+    if (beforeId) params.set('before_id', beforeId);
+    const qs = params.toString();
+    return qs ? `?${qs}` : '';
+}
+
+// Reads an NDJSON stream of {delta} / {done, text} / {error} lines, calling onDelta per piece.
+async function postStream(url, body, onDelta) {
+    const res = await fetch(url, {
+        method: "POST",
+        headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
+        body: new URLSearchParams({ ...body, stream: "1" })
+    });
+    if (!res.ok) {
+        const err = await res.json();
+        throw new Error(err.error || err.answer || 'Server Error');
+    }
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let nl;
+        while ((nl = buffer.indexOf("\n")) >= 0) {
+            const line = buffer.slice(0, nl).trim();
+            buffer = buffer.slice(nl + 1);
+            if (!line) continue;
+            const msg = JSON.parse(line);
+            if (msg.error) throw new Error(msg.error);
+            if (msg.done) return msg;
+            if (msg.delta) onDelta(msg.delta);
+        }
+    }
+    throw new Error('Stream ended unexpectedly');
+}
+
+// --- Background jobs ---
+// With `since` (the job's last updated_at) the server holds the request until the job
+// changes or `wait` seconds pass.
+const JOB_WAIT_SECONDS = 20;
+export const getJob = (jobId, since = "", wait = 0) => get(`/api/jobs/${jobId}${pageQuery(null, since ? { since, wait } : {})}`);
+export const getActiveJobs = (kind, pid) => get(`/api/jobs${pageQuery(null, { kind, project_id: pid })}`);
+
+// Polls until every job is done or failed; resolves with the final job objects.
+export async function waitForJobs(jobIds, onProgress, intervalMs = 1500) {
+    const pending = new Set(jobIds || []);
+    const finished = {};
+    while (pending.size) {
+        for (const id of [...pending]) {
+            const { job } = await getJob(id);
+            if (job.status === 'done' || job.status === 'failed') {
+                finished[id] = job;
+                pending.delete(id);
+            }
+        }
+        if (onProgress) onProgress(Object.keys(finished).length, jobIds.length);
+        if (pending.size) await new Promise(r => setTimeout(r, intervalMs));
+    }
+    return jobIds.map(id => finished[id]);
+}
+
+// Long-polls one job until it finishes, passing every new snapshot to onUpdate (for progress).
+export async function waitForJob(jobId, onUpdate) {
+    let since = "";
+    while (true) {
+        const { job } = await getJob(jobId, since, JOB_WAIT_SECONDS);
+        if (onUpdate && job.updated_at !== since) onUpdate(job);
+        if (job.status === 'done' || job.status === 'failed') return job;
+        since = job.updated_at;
+    }
+}
+
 // --- Notes ---
 export const getNotes = (pid) => get(`/general/${pid}`);
 export const saveNotes = (pid, text) => post(`/general/${pid}`, { text });
@@ -33,17 +120,18 @@ export const updateRule = (pid, data) => post(`/rules/${pid}/update`, data);
 export const deleteRule = (pid, id) => post(`/rules/${pid}/delete`, { id });
 
 // --- Chat & History ---
-export const getChatHistory = (pid) => get(`/chat/${pid}`);
+export const getChatHistory = (pid, beforeId) => get(`/chat/${pid}${pageQuery(beforeId)}`);
 export const clearChatHistory = (pid) => post(`/chat/${pid}/clear`, {});
-export const getPromptHistory = (pid) => get(`/history/${pid}`);
+export const getPromptHistory = (pid, beforeId) => get(`/history/${pid}${pageQuery(beforeId)}`);
 export const clearPromptHistory = (pid) => post(`/history/${pid}/clear`, {});
-export const uploadTempFiles = (pid, formData) => fetch(`/upload_temp_files/${pid}`, { method: "POST", body: formData }).then(res => res.json());
+export const uploadTempFiles = (pid, formData) => postForm(`/upload_temp_files/${pid}`, formData);
 export const askAI = (pid, body) => post(`/ask/${pid}`, body);
+export const askAIStream = (pid, body, onDelta) => postStream(`/ask/${pid}`, body, onDelta);
 
 // --- Synopsis ---
 export const getSynopsis = (pid) => get(`/project/${pid}/synopsis`);
 export const saveSynopsis = (pid, text) => post(`/project/${pid}/synopsis`, { text });
-export const getSynopsisHistory = (pid) => get(`/api/project/${pid}/synopsis_history`);
+export const getSynopsisHistory = (pid, beforeId) => get(`/api/project/${pid}/synopsis_history${pageQuery(beforeId)}`);
 export const clearSynopsisHistory = (pid) => post(`/api/project/${pid}/synopsis_history/clear`, {});
 export const parseSynopsis = (pid, text) => post(`/api/project/${pid}/parse_synopsis`, { text });
 export const loadSynopsisDraft = (pid) => get(`/api/project/${pid}/load_draft`);
@@ -58,10 +146,12 @@ export const getOutline = (pid, chapter_title) => get(`/api/project/${pid}/outli
 export const saveOutline = (pid, chapter_title, outline_text) => post(`/api/project/${pid}/outline`, { chapter_title, outline_text });
 export const updateScene = (pid, body) => post(`/api/project/${pid}/update_scene_from_discussion`, body);
 export const writeScene = (pid, scene_title, scene_description) => post(`/api/project/${pid}/write_scene`, { scene_title, scene_description });
+export const writeSceneStream = (pid, scene_title, scene_description, onDelta) => postStream(`/api/project/${pid}/write_scene`, { scene_title, scene_description }, onDelta);
 export const updateDraft = (pid, body) => post(`/api/project/${pid}/update_draft_from_discussion`, body);
 
 // --- Reviews ---
-export const getReviews = (pid, kind) => get(`/reviews/${pid}?kind=${kind}`);
+export const getReviews = (pid, kind, beforeId) => get(`/reviews/${pid}${pageQuery(beforeId, { kind })}`);
+export const getReview = (pid, review_id) => get(`/review/${pid}/detail/${review_id}`);
 export const runReview = (pid, body) => post(`/review/${pid}/run`, body);
 export const deleteReview = (pid, id) => post(`/reviews/${pid}/delete`, { id });
 export const getReviewDiscussion = (pid, review_id) => get(`/review/${pid}/discussion/${review_id}`);
@@ -70,13 +160,26 @@ export const updateReviewFromDiscussion = (pid, review_id) => post(`/review/${pi
 
 // --- Illustrations & Objects ---
 export const getObjects = (pid) => get(`/project/${pid}/objects/list`);
+// Image and object creation return { job_id }; follow it with waitForJob.
 export const createObject = (pid, body) => post(`/project/${pid}/objects/create`, body);
 export const deleteObject = (pid, object_id) => post(`/project/${pid}/objects/delete`, { object_id });
-export const getImages = (pid) => get(`/images/${pid}`);
+export const getImages = (pid, beforeId) => get(`/images/${pid}${pageQuery(beforeId)}`);
 export const createImage = (pid, body) => post(`/image/${pid}`, body);
 export const deleteImage = (pid, id) => post(`/images/${pid}/delete`, { id });
+// Body: { chapter_title } to use the saved outline, or { scenes: JSON [{label, description}] }; plus style
+export const createStoryboard = (pid, body) => post(`/storyboard/${pid}`, body);
 
 // --- Library ---
-export const getLibraryFiles = () => get(`/api/library/list`);
-export const uploadLibraryFiles = (formData) => fetch(`/api/library/upload`, { method: "POST", body: formData }).then(res => res.json());
+export const getLibraryFiles = (beforeId) => get(`/api/library/list${pageQuery(beforeId, { limit: 200 })}`);
+// The library views filter on the client, so they need every page
+export async function getAllLibraryFiles() {
+    let items = [], beforeId = null;
+    do {
+        const page = await getLibraryFiles(beforeId);
+        items = items.concat(page.items || []);
+        beforeId = page.next_before_id;
+    } while (beforeId);
+    return { items };
+}
+export const uploadLibraryFiles = (formData) => postForm(`/api/library/upload`, formData);
 export const deleteLibraryFile = (id) => post(`/api/library/delete`, { id });
\ No newline at end of file
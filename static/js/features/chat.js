@@ -1,6 +1,6 @@
 // static/js/features/chat.js
-import { openModal, closeAllModals, safeAttach, esc, fmtTime } from '../ui.js';
-import { getChatHistory, clearChatHistory, getPromptHistory, clearPromptHistory, uploadTempFiles, askAI } from '../api.js';
+import { openModal, closeAllModals, safeAttach, esc, fmtTime, appendLoadMore } from '../ui.js';
+import { getChatHistory, clearChatHistory, getPromptHistory, clearPromptHistory, uploadTempFiles, askAIStream, waitForJobs } from '../api.js';
 
 let tempFileIds = [], libraryFileIds = []; // Module-level state
 
@@ -11,16 +11,18 @@ function renderAttachedFiles() {
     // The current implementation in library.js directly manipulates this element.
 }
 
-async function loadChat(pid) {
+async function loadChat(pid, beforeId = null) {
     try {
-        const data = await getChatHistory(pid);
+        const data = await getChatHistory(pid, beforeId);
         const resultEl = document.getElementById('result');
-        resultEl.innerHTML = !data.items.length ? "" : data.items.map(t =>
+        if (!beforeId) resultEl.innerHTML = "";
+        const template = document.createElement('template');
+        template.innerHTML = data.items.map(t =>
             `<div class="turn q"><div class="meta"><span>אתה • ${fmtTime(t.created_at)}</span></div><div class="bubble">${esc(t.question)}</div></div>
              <div class="turn a"><div class="meta"><span>סופר • ${fmtTime(t.created_at)}</span></div><div class="bubble">${esc(t.answer)}<button title="העתק" class="linklike copy-bubble">📋</button></div></div>`
         ).join("");
         
-        resultEl.querySelectorAll('.copy-bubble').forEach(btn => {
+        template.content.querySelectorAll('.copy-bubble').forEach(btn => {
             btn.addEventListener('click', (e) => {
                 const bubble = e.target.closest('.bubble');
                 // Clone the node to avoid modifying the original
@@ -38,7 +40,10 @@ async function loadChat(pid) {
             });
         });
 
-        if (resultEl.children.length > 0) {
+        resultEl.append(template.content);
+        appendLoadMore(resultEl, data.next_before_id, next => loadChat(pid, next));
+
+        if (!beforeId && resultEl.children.length > 0) {
             resultEl.scrollTop = resultEl.scrollHeight;
         }
     } catch (e) {
@@ -63,9 +68,13 @@ export function initChat(pid) {
         
         try {
             const data = await uploadTempFiles(pid, fd);
-            tempFileIds.push(...data.file_ids);
+            if (data.errors && data.errors.length) alert(data.errors.map(er => er.error).join("\n"));
+            await waitForJobs(data.job_ids || [], (done, total) => {
+                status.innerHTML = `<div class='spinner'></div> <span>מעבד קבצים... ${done}/${total}</span>`;
+            });
+            tempFileIds.push(...(data.file_ids || []));
             const listEl = document.getElementById('attached-files-list');
-            listEl.innerHTML += data.filenames.map(name => `<span class="pill" data-type="temp">${esc(name)}</span>`).join("");
+            listEl.innerHTML += (data.filenames || []).map(name => `<span class="pill" data-type="temp">${esc(name)}</span>`).join("");
         } catch (err) {
             alert("שגיאה בהעלאת קבצים: " + err.message);
         } finally {
@@ -100,7 +109,17 @@ export function initChat(pid) {
                 library_file_ids: currentLibraryFileIds
             };
             
-            await askAI(pid, body);
+            // Show the answer as it streams in; loadChat re-renders from the saved History row
+            const resultEl = document.getElementById('result');
+            resultEl.insertAdjacentHTML('afterbegin',
+                `<div class="turn q"><div class="meta"><span>אתה</span></div><div class="bubble">${esc(text)}</div></div>
+                 <div class="turn a"><div class="meta"><span>סופר</span></div><div class="bubble streaming"></div></div>`);
+            const liveBubble = resultEl.querySelector('.bubble.streaming');
+            let firstDelta = true;
+            await askAIStream(pid, body, (delta) => {
+                if (firstDelta) { status.innerHTML = ""; firstDelta = false; }
+                liveBubble.textContent += delta;
+            });
             
             await loadChat(pid);
             promptEl.value = "";
@@ -128,19 +147,26 @@ export function initChat(pid) {
         const histContent = document.getElementById('histContent');
         openModal(document.getElementById('histModal'));
         histContent.innerHTML = "<div class='muted'>טוען...</div>";
-        const data = await getPromptHistory(pid);
-        if (!data.items.length) {
-            histContent.innerHTML = "<div class='muted'>אין היסטוריה.</div>";
-            return;
-        }
-        histContent.innerHTML = data.items.map(q => `<div class='li' title='לחץ להעתקה'>${esc(q)}</div>`).join("");
-        histContent.querySelectorAll('.li').forEach(el => {
-            el.addEventListener("click", () => {
-                document.getElementById('prompt').value = el.textContent;
-                document.getElementById('prompt').focus();
-                closeAllModals();
+        const showPage = async (beforeId) => {
+            const data = await getPromptHistory(pid, beforeId);
+            if (!beforeId && !data.items.length) {
+                histContent.innerHTML = "<div class='muted'>אין היסטוריה.</div>";
+                return;
+            }
+            if (!beforeId) histContent.innerHTML = "";
+            const template = document.createElement('template');
+            template.innerHTML = data.items.map(q => `<div class='li' title='לחץ להעתקה'>${esc(q)}</div>`).join("");
+            template.content.querySelectorAll('.li').forEach(el => {
+                el.addEventListener("click", () => {
+                    document.getElementById('prompt').value = el.textContent;
+                    document.getElementById('prompt').focus();
+                    closeAllModals();
+                });
             });
-        });
+            histContent.append(template.content);
+            appendLoadMore(histContent, data.next_before_id, showPage);
+        };
+        await showPage(null);
     });
 
     safeAttach('closeHistBtn', 'click', closeAllModals);
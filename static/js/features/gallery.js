@@ -1,5 +1,5 @@
 // static/js/features/gallery.js
-import { openModal, closeAllModals, safeAttach, esc } from '../ui.js';
+import { openModal, closeAllModals, safeAttach, esc, appendLoadMore } from '../ui.js';
 import * as api from '../api.js';
 
 let editingImageId = null;
@@ -12,8 +12,8 @@ async function loadObjects(pid) {
         gallery.innerHTML = !data.items.length ? `<div class='muted'>אין אובייקטים.</div>` : 
             data.items.map(obj => `
                 <div class="object-card" data-id="${obj.id}">
-                    <a href="${obj.reference_image_path}" target="_blank" title="הצג בגודל מלא">
-                        <img src="${obj.reference_image_path}" alt="${esc(obj.name)}">
+                    <a href="${obj.webp_url || obj.reference_image_path}" target="_blank" title="הצג בגודל מלא">
+                        <img src="${obj.thumb_url || obj.reference_image_path}" loading="lazy" alt="${esc(obj.name)}">
                     </a>
                     <h5>${esc(obj.name)}</h5>
                     <button class="linklike small del-obj">מחק</button>
@@ -35,48 +35,166 @@ async function loadObjects(pid) {
     }
 }
 
-async function loadGallery(pid) {
+function renderCards(items) {
+    const template = document.createElement('template');
+    template.innerHTML = items.map(it => `
+        <div class="card" data-id="${it.id}">
+            <img src="${it.thumb_url || it.file_path}" loading="lazy" decoding="async">
+            <div class="small">${it.style ? esc(it.style) + " • " : ""}${it.scene_label ? esc(it.scene_label) + " • " : ""}${new Date(it.created_at).toLocaleString('he-IL')}</div>
+            <div class="small" title="${esc(it.prompt)}">${esc((it.prompt || "").slice(0, 80))}...</div>
+            <div class="rowflex">
+                <a class="linklike" href="${it.file_path}" download>הורד</a>
+                <a class="linklike" href="${it.webp_url || it.file_path}" target="_blank">פתח</a>
+                <button class="linklike edit-img" data-id="${it.id}" data-prompt="${esc(it.prompt)}">ערוך</button>
+                <button class="linklike delimg">מחק</button>
+            </div>
+        </div>`).join("");
+    return template.content;
+}
+
+function bindCards(root, pid) {
+    root.querySelectorAll(".delimg").forEach(btn => {
+        btn.addEventListener("click", async () => {
+            const id = btn.closest(".card").getAttribute("data-id");
+            if (!confirm("למחוק?")) return;
+            await api.deleteImage(pid, id);
+            await loadGallery(pid);
+        });
+    });
+
+    root.querySelectorAll('.edit-img').forEach(btn => {
+        btn.addEventListener('click', (e) => {
+            editingImageId = e.target.getAttribute('data-id');
+            const prompt = e.target.getAttribute('data-prompt');
+            document.getElementById('imgDesc').value = prompt;
+            document.getElementById('editingIndicator').style.display = 'block';
+            document.getElementById('illustratePanel').scrollIntoView({ behavior: 'smooth' });
+        });
+    });
+}
+
+async function loadGallery(pid, beforeId = null) {
     const gallery = document.getElementById('gallery');
-    gallery.innerHTML = "<div class='muted'>טוען...</div>";
+    if (!beforeId) gallery.innerHTML = "<div class='muted'>טוען...</div>";
     try {
-        const data = await api.getImages(pid);
-        if (!data.items.length) {
-            gallery.innerHTML = "<div class='muted'>אין איורים.</div>";
-            return;
+        const data = await api.getImages(pid, beforeId);
+        if (!beforeId) {
+            if (!data.items.length) {
+                gallery.innerHTML = "<div class='muted'>אין איורים.</div>";
+                return;
+            }
+            gallery.innerHTML = "";
         }
-        gallery.innerHTML = data.items.map(it => `
-            <div class="card" data-id="${it.id}">
-                <img src="${it.file_path}">
-                <div class="small">${it.style ? esc(it.style) + " • " : ""}${it.scene_label ? esc(it.scene_label) + " • " : ""}${new Date(it.created_at).toLocaleString('he-IL')}</div>
-                <div class="small" title="${esc(it.prompt)}">${esc((it.prompt || "").slice(0, 80))}...</div>
-                <div class="rowflex">
-                    <a class="linklike" href="${it.file_path}" download>הורד</a>
-                    <a class="linklike" href="${it.file_path}" target="_blank">פתח</a>
-                    <button class="linklike edit-img" data-id="${it.id}" data-prompt="${esc(it.prompt)}">ערוך</button>
-                    <button class="linklike delimg">מחק</button>
-                </div>
-            </div>`).join("");
-
-        gallery.querySelectorAll(".delimg").forEach(btn => {
-            btn.addEventListener("click", async () => {
-                const id = btn.closest(".card").getAttribute("data-id");
-                if (!confirm("למחוק?")) return;
-                await api.deleteImage(pid, id);
-                await loadGallery(pid);
-            });
+        const cards = renderCards(data.items);
+        bindCards(cards, pid);
+        gallery.append(cards);
+        appendLoadMore(gallery, data.next_before_id, next => loadGallery(pid, next));
+    } catch (e) {
+        gallery.innerHTML = `<div class='muted'>שגיאה בטעינת הגלריה.</div>`;
+        console.error(e);
+    }
+}
+
+// Image jobs run on the server; each one gets a placeholder card that follows the job
+// and is swapped for the finished illustration.
+const trackedJobs = new Set();
+const JOB_STATUS_TEXT = { queued: "ממתין בתור...", prompting: "מכין תיאור...", generating: "מייצר תמונה..." };
+
+async function trackImageJob(pid, jobId, label) {
+    if (trackedJobs.has(jobId)) return;
+    trackedJobs.add(jobId);
+    const pending = document.getElementById('galleryPending');
+    const card = document.createElement('div');
+    card.className = "card pending";
+    card.innerHTML = `<div class='spinner'></div><div class="small job-status">${JOB_STATUS_TEXT.queued}</div><div class="small">${esc((label || "").slice(0, 80))}</div>`;
+    pending.prepend(card);
+    try {
+        const job = await api.waitForJob(jobId, j => {
+            card.querySelector('.job-status').textContent = JOB_STATUS_TEXT[j.status] || "";
         });
-        
-        gallery.querySelectorAll('.edit-img').forEach(btn => {
-            btn.addEventListener('click', (e) => {
-                editingImageId = e.target.getAttribute('data-id');
-                const prompt = e.target.getAttribute('data-prompt');
-                document.getElementById('imgDesc').value = prompt;
-                document.getElementById('editingIndicator').style.display = 'block';
-                document.getElementById('illustratePanel').scrollIntoView({ behavior: 'smooth' });
-            });
+        if (job.status === 'failed') throw new Error(job.error || 'יצירת האיור נכשלה');
+        card.remove();
+        const gallery = document.getElementById('gallery');
+        if (!gallery.querySelector('.card')) gallery.innerHTML = "";
+        const cards = renderCards([job.result.item]);
+        bindCards(cards, pid);
+        gallery.prepend(cards);
+    } catch (e) {
+        card.innerHTML = `<div class="small">שגיאה: ${esc(e.message)}</div><button class="linklike small">סגור</button>`;
+        card.querySelector('button').addEventListener('click', () => card.remove());
+        console.error(e);
+    } finally {
+        trackedJobs.delete(jobId);
+    }
+}
+
+// A storyboard job reports every frame in its progress; finished frames are added to the
+// gallery as they arrive instead of at the end.
+async function trackStoryboardJob(pid, jobId, label) {
+    if (trackedJobs.has(jobId)) return;
+    trackedJobs.add(jobId);
+    const pending = document.getElementById('galleryPending');
+    const card = document.createElement('div');
+    card.className = "card pending";
+    card.innerHTML = `<div class='spinner'></div><div class="small job-status">🎞️ ממתין...</div><div class="small">${esc(label || "")}</div>`;
+    pending.prepend(card);
+    const shown = new Set();
+    const showFrames = (job) => {
+        const frames = (job.progress && job.progress.frames) || [];
+        const gallery = document.getElementById('gallery');
+        frames.forEach(f => {
+            if (!f.item || shown.has(f.item.id)) return;
+            shown.add(f.item.id);
+            if (!gallery.querySelector('.card')) gallery.innerHTML = "";
+            const cards = renderCards([f.item]);
+            bindCards(cards, pid);
+            gallery.prepend(cards);
         });
+        const p = job.progress || {};
+        if (p.total) {
+            const waiting = frames.some(f => f.status === 'waiting') ? " • ממתין למכסת ה-API" : "";
+            const failed = p.failed ? ` • ${p.failed} נכשלו` : "";
+            card.querySelector('.job-status').textContent = `🎞️ פריימים: ${p.done} / ${p.total}${failed}${waiting}`;
+        }
+    };
+    try {
+        const job = await api.waitForJob(jobId, showFrames);
+        showFrames(job);
+        if (job.status === 'failed') throw new Error(job.error || 'הסטוריבורד נכשל');
+        const failedFrames = (job.progress.frames || []).filter(f => f.status === 'failed');
+        if (!failedFrames.length) {
+            card.remove();
+        } else {
+            card.innerHTML = `<div class="small">${failedFrames.length} פריימים נכשלו: ${esc(failedFrames.map(f => f.label).join(", "))}</div><button class="linklike small">סגור</button>`;
+            card.querySelector('button').addEventListener('click', () => card.remove());
+        }
+    } catch (e) {
+        card.innerHTML = `<div class="small">שגיאה: ${esc(e.message)}</div><button class="linklike small">סגור</button>`;
+        card.querySelector('button').addEventListener('click', () => card.remove());
+        console.error(e);
+    } finally {
+        trackedJobs.delete(jobId);
+    }
+}
+
+async function resumeImageJobs(pid) {
+    try {
+        const [images, storyboards] = await Promise.all([api.getActiveJobs('image', pid), api.getActiveJobs('storyboard', pid)]);
+        images.items.filter(j => j.image_kind === 'illustration').reverse().forEach(j => trackImageJob(pid, j.id, j.label));
+        storyboards.items.reverse().forEach(j => trackStoryboardJob(pid, j.id, j.label));
+    } catch (e) {
+        console.error(e);
+    }
+}
+
+async function loadStoryboardChapters(pid) {
+    const select = document.getElementById('storyboardChapter');
+    if (!select) return;
+    try {
+        const { titles } = await api.getOutlinesList(pid);
+        select.innerHTML = titles.map(t => `<option value="${esc(t)}">${esc(t)}</option>`).join("") ||
+            `<option value="">אין מתווים שמורים</option>`;
     } catch (e) {
-        gallery.innerHTML = `<div class='muted'>שגיאה בטעינת הגלריה.</div>`;
         console.error(e);
     }
 }
@@ -88,7 +206,11 @@ function cancelEditMode() {
 
 export function initGallery(pid) {
     // Custom event listener to load data only when tab is active
-    document.addEventListener('load-gallery', () => loadGallery(pid));
+    document.addEventListener('load-gallery', () => {
+        loadGallery(pid);
+        resumeImageJobs(pid);
+        loadStoryboardChapters(pid);
+    });
     
     safeAttach('objectLabBtn', 'click', () => {
         openModal(document.getElementById('objectLabModal'));
@@ -112,7 +234,11 @@ export function initGallery(pid) {
         status.innerHTML = `<div class='spinner'></div> <span>מייצר תמונת ייחוס...</span>`;
         
         try {
-            await api.createObject(pid, { name, description, style });
+            const { job_id } = await api.createObject(pid, { name, description, style });
+            const job = await api.waitForJob(job_id, j => {
+                if (j.status === 'generating') status.innerHTML = `<div class='spinner'></div> <span>מייצר תמונה...</span>`;
+            });
+            if (job.status === 'failed') throw new Error(job.error || 'יצירת האובייקט נכשלה');
             status.textContent = "נוצר!";
             await loadObjects(pid);
         } catch (e) {
@@ -131,8 +257,7 @@ export function initGallery(pid) {
         const btn = document.getElementById('genImageBtn');
         const status = document.getElementById('imgStatus');
         btn.disabled = true;
-        status.innerHTML = `<div class='spinner'></div> <span>מייצר סצנה...</span>`;
-        
+
         try {
             const body = {
                 desc: desc,
@@ -142,9 +267,10 @@ export function initGallery(pid) {
             if (editingImageId) {
                 body.source_image_id = editingImageId;
             }
-            await api.createImage(pid, body);
-            await loadGallery(pid);
-            status.innerHTML = "נוצר ✓";
+            // Returns once the job is queued, so several images can be requested in a row
+            const { job_id } = await api.createImage(pid, body);
+            trackImageJob(pid, job_id, desc);
+            status.innerHTML = "נשלח ✓";
             setTimeout(() => status.innerHTML = "", 2000);
             cancelEditMode();
         } catch (e) {
@@ -156,5 +282,24 @@ export function initGallery(pid) {
         }
     });
 
+    safeAttach('storyboardBtn', 'click', async () => {
+        const chapter_title = document.getElementById('storyboardChapter').value;
+        if (!chapter_title) return;
+        const btn = document.getElementById('storyboardBtn');
+        btn.disabled = true;
+        try {
+            const { job_id, frames } = await api.createStoryboard(pid, {
+                chapter_title,
+                style: document.getElementById('imgStyle').value || ""
+            });
+            trackStoryboardJob(pid, job_id, `${chapter_title} (${frames.length} פריימים)`);
+        } catch (e) {
+            alert("שגיאה: " + e.message);
+            console.error(e);
+        } finally {
+            btn.disabled = false;
+        }
+    });
+
     safeAttach('cancelEditBtn', 'click', cancelEditMode);
 }
\ No newline at end of file
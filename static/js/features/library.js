@@ -1,14 +1,15 @@
 // static/js/features/library.js
 import { openModal, closeAllModals, safeAttach, esc } from '../ui.js';
-import { getLibraryFiles, uploadLibraryFiles, deleteLibraryFile } from '../api.js';
+import { getAllLibraryFiles, uploadLibraryFiles, deleteLibraryFile, waitForJobs } from '../api.js';
 
 let allLibraryFiles = []; // Cache library files to avoid refetching
+const STATE_LABELS = { queued: 'ממתין לעיבוד', extracting: 'מחלץ טקסט', embedding: 'יוצר אינדקס', failed: 'העיבוד נכשל' };
 
 async function loadLibrary() {
     const libraryList = document.getElementById('libraryList');
     libraryList.innerHTML = `<div class='muted'>טוען...</div>`;
     try {
-        allLibraryFiles = await getLibraryFiles().then(data => data.items || []);
+        allLibraryFiles = await getAllLibraryFiles().then(data => data.items || []);
         renderLibrary();
     } catch (e) {
         libraryList.innerHTML = `<div class='muted'>שגיאה בטעינת הספרייה.</div>`;
@@ -31,7 +32,7 @@ function renderLibrary() {
             <div class="rowflex" style="justify-content:space-between; gap:12px">
                 <div>
                     <h4>${esc(it.filename)}</h4>
-                    <div class="small">${esc(it.ext)} • ${(it.size / 1024).toFixed(1)}KB • ${new Date(it.uploaded_at).toLocaleString('he-IL')}</div>
+                    <div class="small">${esc(it.ext)} • ${(it.size / 1024).toFixed(1)}KB • ${new Date(it.uploaded_at).toLocaleString('he-IL')}${it.state && it.state !== 'done' ? ` • ${STATE_LABELS[it.state] || esc(it.state)}` : ''}</div>
                     <div class="rowflex">
                         <a class="linklike" href="${it.url}" target="_blank">פתח</a>
                         <a class="linklike" href="${it.url}" download>הורד</a>
@@ -69,9 +70,13 @@ export function initLibrary(pid) {
         for (const f of e.target.files) {
             fd.append("files", f);
         }
-        await uploadLibraryFiles(fd);
+        const data = await uploadLibraryFiles(fd);
+        if (data.errors && data.errors.length) alert(data.errors.map(er => er.error).join("\n"));
         await loadLibrary();
         e.target.value = "";
+        // Files are indexed in the background; refresh once they are ready
+        await waitForJobs(data.job_ids || []);
+        await loadLibrary();
     });
 
     safeAttach('attachFromLibraryBtn', 'click', async () => {
@@ -82,7 +87,7 @@ export function initLibrary(pid) {
 
         try {
             if (!allLibraryFiles.length) {
-                 allLibraryFiles = await getLibraryFiles().then(data => data.items || []);
+                 allLibraryFiles = await getAllLibraryFiles().then(data => data.items || []);
             }
             if (!allLibraryFiles.length) {
                 listEl.innerHTML = `<div class='muted'>הספרייה ריקה.</div>`;
@@ -1,17 +1,19 @@
 // static/js/features/review.js
-import { openModal, closeAllModals, safeAttach, esc } from '../ui.js';
+import { openModal, closeAllModals, safeAttach, esc, appendLoadMore } from '../ui.js';
 import * as api from '../api.js';
 
 let currentReviewKind = 'general';
 const discussionModal = document.getElementById('discussionModal');
 
-async function loadReviewList(pid) {
+async function loadReviewList(pid, beforeId = null) {
     const reviewList = document.getElementById('reviewList');
-    reviewList.innerHTML = `<div class='muted'>טוען...</div>`;
+    if (!beforeId) reviewList.innerHTML = `<div class='muted'>טוען...</div>`;
     try {
-        const data = await api.getReviews(pid, currentReviewKind);
-        reviewList.innerHTML = !data.items.length ? `<div class='muted'>אין ביקורות קודמות.</div>` :
-            data.items.map(it => `
+        const data = await api.getReviews(pid, currentReviewKind, beforeId);
+        if (!beforeId) {
+            reviewList.innerHTML = !data.items.length ? `<div class='muted'>אין ביקורות קודמות.</div>` : "";
+        }
+        const html = data.items.map(it => `
                 <div class="li" data-id="${it.id}">
                     <div class="rowflex">
                         <h4 title="${new Date(it.created_at).toLocaleString('he-IL')}">${esc(it.title)}</h4>
@@ -19,14 +21,32 @@ async function loadReviewList(pid) {
                         <button class="linklike discuss">דיון</button>
                         <button class="linklike del">מחק</button>
                     </div>
-                    <div class="box body" style="display:none; white-space:pre-wrap;">${esc(it.result || "")}</div>
+                    <div class="box body" style="display:none; white-space:pre-wrap;"></div>
                 </div>`).join("");
+        const template = document.createElement('template');
+        template.innerHTML = html;
+        const newItems = [...template.content.querySelectorAll(".li")];
+        reviewList.append(template.content);
 
-        reviewList.querySelectorAll(".li").forEach(li => {
+        newItems.forEach(li => {
             const id = li.getAttribute("data-id");
             const title = li.querySelector("h4").textContent;
-            li.querySelector(".show").addEventListener("click", () => {
+            li.querySelector(".show").addEventListener("click", async () => {
                 const body = li.querySelector(".body");
+                // The list leaves out the review text; it is fetched the first time it is shown
+                if (!body.dataset.loaded) {
+                    body.textContent = "טוען...";
+                    body.style.display = "block";
+                    try {
+                        const detail = await api.getReview(pid, id);
+                        body.textContent = detail.item.result || "";
+                        body.dataset.loaded = "1";
+                    } catch (e) {
+                        body.textContent = "שגיאה בטעינה.";
+                        console.error(e);
+                    }
+                    return;
+                }
                 body.style.display = (body.style.display === "none" ? "block" : "none");
             });
             li.querySelector(".del").addEventListener("click", async () => {
@@ -37,6 +57,7 @@ async function loadReviewList(pid) {
             });
             li.querySelector(".discuss").addEventListener("click", () => openDiscussionModal(pid, id, title));
         });
+        appendLoadMore(reviewList, data.next_before_id, next => loadReviewList(pid, next));
     } catch (e) {
         reviewList.innerHTML = `<div class='muted'>שגיאה בטעינה.</div>`;
         console.error(e);
@@ -150,8 +171,17 @@ export function initReview(pid) {
             rvStatus.innerHTML = `<div class='spinner'></div> <span>מריץ ביקורת... (זה עשוי לקחת זמן)</span>`;
             btn.disabled = true;
             
-            const data = await api.runReview(pid, { kind: currentReviewKind, source, input_text: text });
-            reviewOut.textContent = data.result || "—";
+            const { job_id } = await api.runReview(pid, { kind: currentReviewKind, source, input_text: text });
+            const job = await api.waitForJob(job_id, j => {
+                const p = j.progress || {};
+                if (j.status === 'synthesizing') {
+                    rvStatus.innerHTML = `<div class='spinner'></div> <span>מאחד את הממצאים לדוח אחד...</span>`;
+                } else if (p.chunks_total) {
+                    rvStatus.innerHTML = `<div class='spinner'></div> <span>בודק חלקים: ${p.chunks_done} / ${p.chunks_total}</span>`;
+                }
+            });
+            if (job.status === 'failed') throw new Error(job.error || 'הביקורת נכשלה');
+            reviewOut.textContent = job.result.result || "—";
             await loadReviewList(pid);
             rvStatus.textContent = "הושלם!";
         } catch (e) {
@@ -1,22 +1,24 @@
 // static/js/features/synopsis.js
-import { openModal, closeAllModals, safeAttach, esc } from '../ui.js';
+import { openModal, closeAllModals, safeAttach, esc, appendLoadMore } from '../ui.js';
 import * as api from '../api.js';
 
 let currentChapterDiscussion = { title: "", originalContent: "", thread: [] };
 let currentSynopsisBuilder = { thread: [] };
 let currentDivisionRefinement = { originalDivision: "", thread: [] };
 
-async function loadSynopsisHistory(pid) {
+async function loadSynopsisHistory(pid, beforeId = null) {
     const historyEl = document.getElementById('synopsisHistory');
     if (!historyEl) return;
-    historyEl.innerHTML = `<div class='muted'>טוען היסטוריה...</div>`;
+    if (!beforeId) historyEl.innerHTML = `<div class='muted'>טוען היסטוריה...</div>`;
     try {
-        const data = await api.getSynopsisHistory(pid);
-        if (!data.items || data.items.length === 0) {
+        const data = await api.getSynopsisHistory(pid, beforeId);
+        if (!beforeId && (!data.items || data.items.length === 0)) {
             historyEl.innerHTML = `<div class='muted'>אין היסטוריית גרסאות.</div>`;
             return;
         }
-        historyEl.innerHTML = data.items.map(item => `
+        if (!beforeId) historyEl.innerHTML = '';
+        const template = document.createElement('template');
+        template.innerHTML = data.items.map(item => `
             <div class="li">
                 <div class="rowflex" style="justify-content: space-between;">
                     <strong>גרסה מתאריך ${new Date(item.created_at).toLocaleString('he-IL')}</strong>
@@ -25,13 +27,15 @@ async function loadSynopsisHistory(pid) {
                 <div class="box" style="margin-top:4px;">${esc(item.text)}</div>
             </div>`).join('');
         
-        historyEl.querySelectorAll('.restore-synopsis-btn').forEach(btn => {
+        template.content.querySelectorAll('.restore-synopsis-btn').forEach(btn => {
             btn.addEventListener('click', (e) => {
                 const text = e.target.closest('.li').querySelector('.box').textContent;
                 document.getElementById('synopsisArea').value = text;
                 alert('הגרסה שוחזרה לעורך. לחץ "שמור תקציר" כדי לשמור את השינויים.');
             });
         });
+        historyEl.append(template.content);
+        appendLoadMore(historyEl, data.next_before_id, next => loadSynopsisHistory(pid, next));
     } catch (e) {
         historyEl.innerHTML = `<div class='muted'>שגיאה בטעינת ההיסטוריה.</div>`;
         console.error(e);
@@ -11,6 +11,19 @@ export function fmtTime(iso) {
     return d.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
 }
 
+// Adds a "load more" button under a paged list; it removes itself and calls onMore(nextBeforeId)
+export function appendLoadMore(container, nextBeforeId, onMore) {
+    if (!container || !nextBeforeId) return;
+    const btn = document.createElement('button');
+    btn.className = 'linklike load-more';
+    btn.textContent = 'טען עוד';
+    btn.addEventListener('click', () => {
+        btn.remove();
+        onMore(nextBeforeId);
+    });
+    container.appendChild(btn);
+}
+
 export function openModal(el) {
     if (el) {
         el.style.display = "block";